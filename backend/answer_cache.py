@@ -0,0 +1,150 @@
+"""
+Cache of generated answers to questions about a record.
+
+Keyed by record and normalized question text. Near-duplicate reuse is
+opt-in: with ASK_CACHE_SIMILARITY > 0, an exact miss whose question
+embedding is at least that cosine-similar to an earlier question about the
+same record reuses that answer. Close wording can still ask a different
+clinical question ("left" / "right", "increased" / "decreased"), so keep
+it off unless the threshold has been validated on real questions. Every
+entry remembers the version of the record's text it was generated from,
+so re-extracted records never serve stale answers.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable, Optional
+from uuid import UUID
+
+import numpy as np
+
+from cache import TTLCache
+from metrics import metrics
+from vector_index import normalize_rows
+
+# Configuration
+ASK_CACHE_SIZE = int(os.getenv("ASK_CACHE_SIZE", "2048"))
+ASK_CACHE_TTL = float(os.getenv("ASK_CACHE_TTL", "86400"))
+ASK_CACHE_SIMILARITY = float(os.getenv("ASK_CACHE_SIMILARITY", "0"))  # 0 = exact matches only
+ASK_CACHE_PER_RECORD = int(os.getenv("ASK_CACHE_PER_RECORD", "64"))
+
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", question.lower()).strip(" ?!.")
+
+
+@dataclass(frozen=True)
+class CachedAnswer:
+    answer: str
+    text_version: Hashable
+    generation_seconds: float
+
+
+class AnswerCache:
+    """LRU/TTL answers plus per-record question vectors for similarity hits"""
+
+    def __init__(
+        self,
+        maxsize: int = ASK_CACHE_SIZE,
+        ttl: float = ASK_CACHE_TTL,
+        similarity: float = ASK_CACHE_SIMILARITY,
+        per_record: int = ASK_CACHE_PER_RECORD
+    ):
+        self.maxsize = maxsize
+        self.similarity = similarity
+        self.per_record = per_record
+        self.hits = 0
+        self.misses = 0
+        self._answers = TTLCache(maxsize=maxsize, ttl=ttl)
+        # record_id -> normalized question -> unit question vector, both LRU
+        self._questions: "OrderedDict[UUID, OrderedDict[str, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _hit(self, entry: CachedAnswer, kind: str) -> str:
+        self.hits += 1
+        metrics.incr(f"ask.cache.{kind}_hits")
+        metrics.incr("ask.cache.seconds_saved", entry.generation_seconds)
+        return entry.answer
+
+    def _nearest(self, record_id: UUID, question_vector: np.ndarray) -> Optional[str]:
+        with self._lock:
+            questions = self._questions.get(record_id)
+            if not questions:
+                return None
+            keys = list(questions)
+            matrix = np.stack(list(questions.values()))
+        scores = matrix @ normalize_rows(question_vector)[0]
+        best = int(np.argmax(scores))
+        return keys[best] if scores[best] >= self.similarity else None
+
+    def lookup(
+        self,
+        record_id: UUID,
+        text_version: Hashable,
+        question: str,
+        question_vector: Optional[np.ndarray] = None
+    ) -> Optional[str]:
+        """
+        Cached answer or None. Without question_vector only the exact
+        question is tried, so callers can skip embedding on exact hits.
+        """
+        key = normalize_question(question)
+        entry = self._answers.get((record_id, key))
+        if entry is not None and entry.text_version == text_version:
+            return self._hit(entry, "exact")
+        if question_vector is None:
+            return None
+
+        if self.similarity > 0:
+            similar = self._nearest(record_id, question_vector)
+            if similar is not None and similar != key:
+                entry = self._answers.get((record_id, similar))
+                if entry is not None and entry.text_version == text_version:
+                    return self._hit(entry, "similar")
+        self.misses += 1
+        metrics.incr("ask.cache.misses")
+        return None
+
+    def store(
+        self,
+        record_id: UUID,
+        text_version: Hashable,
+        question: str,
+        question_vector: np.ndarray,
+        answer: str,
+        generation_seconds: float
+    ):
+        key = normalize_question(question)
+        self._answers.set((record_id, key), CachedAnswer(answer, text_version, generation_seconds))
+        with self._lock:
+            questions = self._questions.setdefault(record_id, OrderedDict())
+            self._questions.move_to_end(record_id)
+            questions[key] = normalize_rows(question_vector)[0]
+            questions.move_to_end(key)
+            while len(questions) > self.per_record:
+                questions.popitem(last=False)
+            while len(self._questions) > self.maxsize:
+                self._questions.popitem(last=False)
+
+    def invalidate_record(self, record_id: UUID):
+        """Drop every cached answer for a record"""
+        with self._lock:
+            keys = list(self._questions.pop(record_id, {}))
+        for key in keys:
+            self._answers.pop((record_id, key))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._answers),
+            "records": len(self._questions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+answer_cache = AnswerCache()
+metrics.register_gauge("ask.cache", answer_cache.stats)
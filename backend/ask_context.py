@@ -0,0 +1,115 @@
+"""
+Prompt context for questions about a single record.
+
+Only the record's chunks most similar to the question are sent to the
+model, up to ASK_CONTEXT_TOKENS. Chunk vectors come from the vector index
+when the record has been embedded; otherwise they are computed once and
+kept in a per-record cache.
+"""
+import asyncio
+import os
+from datetime import datetime
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import TTLCache
+from embedder import embedder, estimate_tokens
+from metrics import metrics
+from models import RecordText
+from vector_index import vector_index, normalize_rows
+
+# Configuration
+ASK_TOP_K = int(os.getenv("ASK_TOP_K", "8"))
+ASK_CONTEXT_TOKENS = int(os.getenv("ASK_CONTEXT_TOKENS", "3000"))
+ASK_CHUNK_CACHE_SIZE = int(os.getenv("ASK_CHUNK_CACHE_SIZE", "256"))
+ASK_CHUNK_CACHE_TTL = float(os.getenv("ASK_CHUNK_CACHE_TTL", "3600"))
+
+# record_id -> (chunk ids, normalized chunk matrix) for records not in the index
+chunk_vector_cache = TTLCache(maxsize=ASK_CHUNK_CACHE_SIZE, ttl=ASK_CHUNK_CACHE_TTL)
+metrics.register_gauge("ask.chunk_cache", chunk_vector_cache.stats)
+
+
+async def record_text_version(db: AsyncSession, record_id: UUID) -> Tuple[int, Optional[datetime]]:
+    """Changes whenever the record is re-chunked (rows are replaced, not updated)"""
+    row = (await db.execute(
+        select(func.count(RecordText.id), func.max(RecordText.created_at))
+        .where(RecordText.record_id == record_id)
+    )).one()
+    return tuple(row)
+
+
+async def _chunk_vectors(db: AsyncSession, record_id: UUID) -> Tuple[List[UUID], np.ndarray]:
+    chunks = (await db.execute(
+        select(RecordText.id, RecordText.extracted_text)
+        .where(RecordText.record_id == record_id)
+        .order_by(RecordText.chunk_index)
+    )).all()
+    chunk_ids = [chunk.id for chunk in chunks]
+
+    cached = chunk_vector_cache.get(record_id)
+    # Re-chunking creates new rows, so matching ids mean matching text
+    if cached is not None and cached[0] == chunk_ids:
+        return cached
+    if not chunks:
+        return chunk_ids, np.empty((0, vector_index.dim), dtype=np.float32)
+
+    vectors = normalize_rows(await embedder.embed([chunk.extracted_text for chunk in chunks]))
+    chunk_vector_cache.set(record_id, (chunk_ids, vectors))
+    return chunk_ids, vectors
+
+
+async def rank_chunks(db: AsyncSession, record_id: UUID, question_vector: np.ndarray, k: int = ASK_TOP_K) -> List[UUID]:
+    """Ids of the record's k chunks most similar to the question, best first"""
+    await asyncio.to_thread(vector_index.ensure_loaded)
+    hits = await asyncio.to_thread(vector_index.search, question_vector, k=k, record_ids=[record_id])
+    if hits:
+        return [chunk_id for _, _, chunk_id, _ in hits if chunk_id is not None]
+
+    chunk_ids, vectors = await _chunk_vectors(db, record_id)
+    if not chunk_ids:
+        return []
+    scores = vectors @ normalize_rows(question_vector)[0]
+    order = np.argsort(-scores)[:k]
+    return [chunk_ids[i] for i in order]
+
+
+async def assemble_context(
+    db: AsyncSession,
+    record_id: UUID,
+    question_vector: np.ndarray,
+    k: int = ASK_TOP_K,
+    max_tokens: int = ASK_CONTEXT_TOKENS
+) -> str:
+    """Best-matching chunks that fit max_tokens, joined in document order"""
+    ranked = await rank_chunks(db, record_id, question_vector, k)
+    if not ranked:
+        return ""
+
+    texts = {
+        row.id: row for row in (await db.execute(
+            select(RecordText.id, RecordText.chunk_index, RecordText.extracted_text)
+            .where(RecordText.id.in_(ranked))
+        )).all()
+    }
+
+    selected, used = [], 0
+    for chunk_id in ranked:
+        row = texts.get(chunk_id)
+        if row is None:
+            continue
+        tokens = estimate_tokens(row.extracted_text)
+        if used + tokens <= max_tokens:
+            selected.append((row.chunk_index, row.extracted_text))
+            used += tokens
+        elif not selected:
+            # Even the best chunk is over budget: send its beginning
+            selected.append((row.chunk_index, row.extracted_text[:max_tokens * 4]))
+            used = max_tokens
+
+    metrics.incr("ask.context_chunks", len(selected))
+    metrics.incr("ask.context_tokens", used)
+    return "\n\n".join(text for _, text in sorted(selected))
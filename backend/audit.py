@@ -0,0 +1,211 @@
+"""
+Write-behind audit logging.
+
+Entries are buffered in memory and written to access_logs in multi-row
+INSERTs by a background thread, once AUDIT_BATCH_SIZE entries are waiting
+or every AUDIT_FLUSH_SECONDS. Entries for security-relevant changes (e.g.
+deletes, shares) skip the buffer: they are added to the route's own
+session and commit or roll back with the change. Entries the database rejects are logged
+and dropped; while it is unreachable at most AUDIT_MAX_BUFFER entries are
+kept, the oldest dropped first.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, List, Optional
+from uuid import UUID, uuid4
+
+from fastapi import Request
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+
+from database import SessionLocal
+from metrics import metrics
+from models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "2"))
+AUDIT_MAX_BUFFER = int(os.getenv("AUDIT_MAX_BUFFER", "10000"))
+
+
+def client_ip(request: Request) -> Optional[str]:
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else None
+
+
+class AuditSink:
+    """Bounded in-memory buffer of audit entries flushed in bulk"""
+
+    def __init__(
+        self,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        flush_seconds: float = AUDIT_FLUSH_SECONDS,
+        max_buffer: int = AUDIT_MAX_BUFFER
+    ):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self._buffer: Deque[dict] = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="audit-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flusher and write whatever is still buffered"""
+        if self._thread is not None:
+            with self._cond:
+                self._stopping = True
+                self._cond.notify()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._buffer) < self.batch_size:
+                    self._cond.wait(self.flush_seconds)
+                stopping = self._stopping
+            if stopping:
+                return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Audit flush failed, entries kept for the next attempt")
+
+    def append(self, entry: dict) -> int:
+        """Buffer an entry, returns the buffer length"""
+        with self._cond:
+            self._buffer.append(entry)
+            self._trim()
+            size = len(self._buffer)
+            if size >= self.batch_size:
+                self._cond.notify()
+        return size
+
+    def _trim(self):
+        """Drop the oldest entries beyond max_buffer (caller holds _cond)"""
+        dropped = 0
+        while len(self._buffer) > self.max_buffer:
+            self._buffer.popleft()
+            dropped += 1
+        if dropped:
+            metrics.incr("audit.dropped", dropped)
+
+    def _requeue(self, rows: List[dict]):
+        with self._cond:
+            # Back in front of anything logged meanwhile
+            self._buffer.extendleft(reversed(rows))
+            self._trim()
+
+    def flush(self) -> int:
+        """
+        Write every buffered entry in one multi-row INSERT (blocking). If the
+        batch fails, entries are retried one at a time: ones the database
+        rejects (e.g. their user was deleted) are dropped, and on any other
+        error the rest go back to the buffer and the error is raised.
+        """
+        with self._flush_lock:
+            with self._cond:
+                rows = list(self._buffer)
+                self._buffer.clear()
+            if not rows:
+                return 0
+            start = time.perf_counter()
+            db = SessionLocal()
+            try:
+                try:
+                    db.execute(insert(AuditLog), rows)
+                    db.commit()
+                    written = len(rows)
+                except Exception:
+                    db.rollback()
+                    metrics.incr("audit.flush_errors")
+                    written = self._write_each(db, rows)
+            finally:
+                db.close()
+            metrics.observe("audit.flush", time.perf_counter() - start)
+            metrics.incr("audit.written", written)
+            return written
+
+    def _write_each(self, db, rows: List[dict]) -> int:
+        written = 0
+        for index, row in enumerate(rows):
+            try:
+                db.execute(insert(AuditLog), [row])
+                db.commit()
+                written += 1
+            except (IntegrityError, DataError):
+                db.rollback()
+                metrics.incr("audit.rejected")
+                logger.error("Audit entry rejected by the database, dropped: %r", row)
+            except Exception:
+                db.rollback()
+                self._requeue(rows[index:])
+                raise
+        return written
+
+    async def log(
+        self,
+        user_id: UUID,
+        action: str,
+        resource: str,
+        resource_id: UUID = None,
+        request: Request = None,
+        db=None
+    ):
+        """Queue an audit entry, or with db add it to that session's transaction"""
+        entry = {
+            "id": uuid4(),
+            "user_id": user_id,
+            "action": action,
+            "resource": resource,
+            "resource_id": resource_id,
+            "timestamp": datetime.utcnow(),
+            "ip_address": client_ip(request) if request else None,
+            "user_agent": request.headers.get("user-agent") if request else None
+        }
+        if db is not None:
+            # Committed by the caller together with the action it records
+            db.add(AuditLog(**entry))
+            metrics.incr("audit.in_transaction")
+            return
+        self.append(entry)
+
+
+audit_sink = AuditSink()
+metrics.register_gauge("audit.buffered", lambda: len(audit_sink))
+
+
+async def log_access(
+    user_id: UUID,
+    action: str,
+    resource: str,
+    resource_id: UUID = None,
+    request: Request = None,
+    db=None
+):
+    """
+    Log access for audit trail. Pass the route's session as db, before its
+    commit, to make the entry part of the same transaction.
+    """
+    await audit_sink.log(user_id, action, resource, resource_id, request, db)
@@ -3,22 +3,60 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from dataclasses import dataclass
 import os
-from typing import Optional
+from typing import List, Optional, Tuple
 from uuid import UUID
 
-from database import get_db
+from cache import TTLCache
+from database import get_async_db
+from invalidation import invalidations
+from metrics import metrics
 from models import User, UserRole, RoleEnum
 
 # Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
+@dataclass(frozen=True)
+class Principal:
+    """Authenticated user plus roles, detached from any DB session"""
+    id: UUID
+    phone: Optional[str]
+    email: Optional[str]
+    phone_verified: bool
+    email_verified: bool
+    roles: Tuple[str, ...]
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            id=user.id,
+            phone=user.phone,
+            email=user.email,
+            phone_verified=user.phone_verified,
+            email_verified=user.email_verified,
+            roles=tuple(role.role.value for role in user.roles)
+        )
+
+# Keyed by token subject (user id); invalidate when roles or the user change
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+metrics.register_gauge("auth.principal_cache", principal_cache.stats)
+invalidations.subscribe("principal", principal_cache.pop)
+
+def invalidate_principal(db, user_id: UUID):
+    """Call before committing a change to the user or their roles; reaches every worker"""
+    invalidations.publish(db, "principal", user_id)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -37,8 +75,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
+    db: AsyncSession = Depends(get_async_db)
+) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -53,22 +91,32 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.id == UUID(user_id)).first()
+    await invalidations.poll(db)
+    principal = principal_cache.get(user_id)
+    if principal is not None:
+        return principal
+    
+    # User and roles in one joined query
+    result = await db.execute(
+        select(User).options(joinedload(User.roles)).where(User.id == UUID(user_id))
+    )
+    user = result.unique().scalar_one_or_none()
     if user is None:
         raise credentials_exception
-    return user
+    
+    principal = Principal.from_user(user)
+    principal_cache.set(user_id, principal)
+    return principal
 
-def get_user_roles(user: User, db: Session) -> List[str]:
-    roles = db.query(UserRole).filter(UserRole.user_id == user.id).all()
-    return [role.role.value for role in roles]
+async def get_user_roles(user: User, db: AsyncSession) -> List[str]:
+    roles = await db.scalars(select(UserRole.role).where(UserRole.user_id == user.id))
+    return [role.value for role in roles]
 
 def require_role(required_roles: List[str]):
     async def role_checker(
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user)
     ):
-        user_roles = get_user_roles(current_user, db)
-        if not any(role in user_roles for role in required_roles):
+        if not any(role in current_user.roles for role in required_roles):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Insufficient permissions"
@@ -0,0 +1,112 @@
+"""
+Concurrent-request throughput: sync Session vs AsyncSession inside async routes.
+
+Usage (from backend/):
+    python -m benchmarks.bench_async_db [--url postgresql://...] [--requests 200] [--query-ms 20]
+
+Two in-process FastAPI apps expose the same endpoint running one slow query
+(pg_sleep on Postgres, a registered sleep() function on SQLite). The "before"
+app calls a sync Session from an async def route, like the routers used to;
+the "after" app awaits an AsyncSession from get_async_db-style dependency.
+Requests are fired concurrently through httpx's ASGI transport, so no server
+or network is involved.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from database import async_database_url
+
+
+def sleep_statement(url: str, query_ms: int):
+    if url.startswith("sqlite"):
+        return text(f"SELECT sleep_ms({query_ms})")
+    return text(f"SELECT pg_sleep({query_ms / 1000})")
+
+
+def register_sqlite_sleep(engine):
+    @event.listens_for(engine, "connect")
+    def add_sleep(dbapi_connection, _):
+        dbapi_connection.create_function("sleep_ms", 1, lambda ms: time.sleep(ms / 1000) or 0)
+
+
+def build_apps(url: str, query_ms: int, pool_size: int):
+    statement = sleep_statement(url, query_ms)
+    # Room for every in-flight request, so the pool itself is never the bottleneck
+    pool_args = {"pool_size": pool_size, "max_overflow": pool_size}
+
+    sync_engine = create_engine(url, **pool_args)
+    async_engine = create_async_engine(async_database_url(url), **pool_args)
+    if url.startswith("sqlite"):
+        register_sqlite_sleep(sync_engine)
+        register_sqlite_sleep(async_engine.sync_engine)
+    SyncSession = sessionmaker(bind=sync_engine)
+    AsyncSessionMaker = async_sessionmaker(async_engine, expire_on_commit=False)
+
+    def get_sync_db():
+        db = SyncSession()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def get_async_db():
+        async with AsyncSessionMaker() as db:
+            yield db
+
+    before = FastAPI()
+
+    @before.get("/query")
+    async def sync_query(db: Session = Depends(get_sync_db)):
+        return {"value": db.execute(statement).scalar()}
+
+    after = FastAPI()
+
+    @after.get("/query")
+    async def async_query(db: AsyncSession = Depends(get_async_db)):
+        return {"value": (await db.execute(statement)).scalar()}
+
+    return before, after, sync_engine, async_engine
+
+
+async def measure(app, requests: int, concurrency: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                response = await client.get("/query")
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        return time.perf_counter() - start
+
+
+async def main(args):
+    url = args.url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    before, after, sync_engine, async_engine = build_apps(url, args.query_ms, args.concurrency)
+    try:
+        for name, app in (("before (sync Session)", before), ("after (AsyncSession)", after)):
+            elapsed = await measure(app, args.requests, args.concurrency)
+            print(f"{name}: {args.requests} requests in {elapsed:.2f}s  {args.requests / elapsed:.0f} req/s")
+    finally:
+        sync_engine.dispose()
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync vs async session throughput")
+    parser.add_argument("--url", help="database URL (default: temporary SQLite file)")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--query-ms", type=int, default=20, help="duration of the simulated query")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,62 @@
+"""
+Offline throughput benchmark for the batching embedder.
+
+Usage (from backend/):
+    python -m benchmarks.bench_embedder [--chunks 500] [--latency 0.05]
+
+Compares one provider call per chunk (the old create_embeddings loop)
+against BatchingEmbedder, using FakeEmbeddingProvider with a simulated
+round-trip latency so no network access is needed. The last line is the
+CPU-only LocalEmbeddingProvider (EMBEDDING_PROVIDER=local) on the same chunks.
+"""
+import argparse
+import asyncio
+import time
+
+from embedder import BatchingEmbedder, FakeEmbeddingProvider, LocalEmbeddingProvider
+
+
+def make_chunks(count: int):
+    return [f"Chunk {i}: hemoglobin 13.{i % 10} g/dL, WBC {4000 + i} /uL. " * 20 for i in range(count)]
+
+
+async def sequential(provider, chunks):
+    for chunk in chunks:
+        await provider.embed([chunk])
+
+
+async def main(args):
+    chunks = make_chunks(args.chunks)
+
+    provider = FakeEmbeddingProvider(latency=args.latency, per_item_latency=args.per_item_latency)
+    start = time.perf_counter()
+    await sequential(provider, chunks)
+    seq_time = time.perf_counter() - start
+    print(f"sequential: {seq_time:.2f}s  {len(chunks) / seq_time:.0f} chunks/s  {provider.calls} requests")
+
+    for concurrency in (1, 4, 8):
+        provider = FakeEmbeddingProvider(latency=args.latency, per_item_latency=args.per_item_latency)
+        embedder = BatchingEmbedder(provider, max_batch_tokens=args.batch_tokens, max_concurrency=concurrency)
+        start = time.perf_counter()
+        await embedder.embed(chunks)
+        elapsed = time.perf_counter() - start
+        print(
+            f"batched (concurrency={concurrency}): {elapsed:.2f}s  "
+            f"{len(chunks) / elapsed:.0f} chunks/s  {provider.calls} requests  "
+            f"speedup {seq_time / elapsed:.1f}x"
+        )
+
+    embedder = BatchingEmbedder(LocalEmbeddingProvider(), max_batch_tokens=args.batch_tokens, max_concurrency=4)
+    start = time.perf_counter()
+    await embedder.embed(chunks)
+    elapsed = time.perf_counter() - start
+    print(f"local provider (concurrency=4): {elapsed:.2f}s  {len(chunks) / elapsed:.0f} chunks/s  no requests")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batching embedder benchmark")
+    parser.add_argument("--chunks", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated seconds per request")
+    parser.add_argument("--per-item-latency", type=float, default=0.0005, help="simulated seconds per text")
+    parser.add_argument("--batch-tokens", type=int, default=8000)
+    asyncio.run(main(parser.parse_args()))
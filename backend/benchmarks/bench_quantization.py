@@ -0,0 +1,81 @@
+"""
+Recall@10 vs resident memory for the vector index quantization settings.
+
+Usage (from backend/):
+    python -m benchmarks.bench_quantization [--rows 20000] [--dim 1536] [--queries 100]
+
+Builds one VectorIndex per setting (float32, int8 and binary first pass
+with several re-rank candidate counts) over synthetic clustered unit
+vectors. Each setting's top 10 is compared with the exact float32 top 10.
+Memory is the resident scoring arrays; quantized settings also keep the
+float32 rows in a memory-mapped scratch file, paged in only for re-ranking.
+"""
+import argparse
+import time
+from uuid import uuid4
+
+import numpy as np
+
+from vector_index import VectorIndex, normalize_rows
+
+
+def make_vectors(rows: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    # Embeddings of similar reports cluster, which is what makes coarse scoring hard
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(0, clusters, rows)] + 0.6 * rng.normal(size=(rows, dim))
+    return normalize_rows(vectors)
+
+
+def build(vectors: np.ndarray, ids: list, quantization: str, rerank: int) -> VectorIndex:
+    index = VectorIndex(dim=vectors.shape[1], quantization=quantization, rerank_candidates=rerank)
+    patient_id = uuid4()
+    for start in range(0, len(ids), 5000):
+        batch = ids[start:start + 5000]
+        index.add(batch, batch, batch, [patient_id] * len(batch), vectors[start:start + 5000])
+    return index
+
+
+def top_ids(index: VectorIndex, query: np.ndarray):
+    return [hit[0] for hit in index.search(query, k=10)]
+
+
+def main(args):
+    vectors = make_vectors(args.rows, args.dim, args.clusters, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    picks = rng.integers(0, args.rows, args.queries)
+    # Unit-norm noise: queries are near, not equal to, an indexed chunk
+    queries = vectors[picks] + args.noise * rng.normal(size=(args.queries, args.dim)) / np.sqrt(args.dim)
+    ids = [uuid4() for _ in range(args.rows)]
+
+    baseline = build(vectors, ids, "none", 0)
+    truth = [set(top_ids(baseline, query)) for query in queries]
+    base_bytes = baseline.memory_bytes()
+    print(f"{args.rows} rows x {args.dim} dims, {args.queries} queries")
+    print(f"{'setting':<22}{'recall@10':>10}{'MB':>9}{'bytes/row':>11}{'vs float32':>12}{'ms/query':>10}")
+
+    settings = [("none", 0)] + [(q, r) for q in ("int8", "binary") for r in args.rerank]
+    for quantization, rerank in settings:
+        index = baseline if quantization == "none" else build(vectors, ids, quantization, rerank)
+        start = time.perf_counter()
+        results = [top_ids(index, query) for query in queries]
+        elapsed = time.perf_counter() - start
+        recall = np.mean([len(truth[i].intersection(found)) / 10 for i, found in enumerate(results)])
+        resident = index.memory_bytes()
+        label = quantization if quantization == "none" else f"{quantization} rerank={rerank}"
+        print(
+            f"{label:<22}{recall:>10.3f}{resident / 2**20:>9.1f}{resident / args.rows:>11.0f}"
+            f"{resident / base_bytes:>11.1%}{1000 * elapsed / args.queries:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vector index quantization benchmark")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=1.0)
+    parser.add_argument("--rerank", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
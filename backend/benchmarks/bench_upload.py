@@ -0,0 +1,141 @@
+"""
+Streaming S3 upload: throughput, parts held in memory and correctness.
+
+Usage (from backend/):
+    python -m benchmarks.bench_upload [--size-mb 256] [--part-mb 8] [--concurrency 4] [--latency-ms 50]
+
+Runs storage.upload_stream against an in-process fake S3 client whose
+upload_part sleeps for --latency-ms (the network round trip) and records
+what it received. The body is generated on the fly, so the only large
+buffers are the parts upload_stream holds. Checks the returned SHA-256,
+size and part count, that every part arrived intact, and that no more
+than --concurrency parts were ever uploading at once. Peak traced memory
+divided by the part size is the number of parts held at the same time.
+"""
+import argparse
+import asyncio
+import hashlib
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+from storage import upload_stream
+
+
+class FakeUpload:
+    """UploadFile stand-in serving size bytes from a repeated random block"""
+
+    def __init__(self, size: int, seed: int):
+        self.size = size
+        self.offset = 0
+        self.block = np.random.default_rng(seed).integers(0, 256, 1024 * 1024 + 7, dtype=np.uint8).tobytes()
+
+    def chunk(self, offset: int, n: int) -> bytes:
+        n = max(0, min(n, self.size - offset))
+        block, start, pieces = memoryview(self.block), offset % len(self.block), []
+        while n > 0:
+            take = min(n, len(block) - start)
+            pieces.append(block[start:start + take])  # views, so join makes the only copy
+            n -= take
+            start = 0
+        return b"".join(pieces)
+
+    async def read(self, n: int) -> bytes:
+        data = self.chunk(self.offset, n)
+        self.offset += len(data)
+        return data
+
+
+class FakeS3:
+    """Records part sizes and digests; upload_part blocks like a network call"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.parts = {}
+        self.objects = {}
+        self.completed = None
+        self.aborted = False
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = hashlib.sha256(Body).hexdigest()
+
+    def create_multipart_upload(self, Bucket, Key):
+        return {"UploadId": "bench"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            self.parts[PartNumber] = (len(Body), hashlib.sha256(Body).hexdigest())
+            return {"ETag": f'"{PartNumber}"'}
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.completed = [part["PartNumber"] for part in MultipartUpload["Parts"]]
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted = True
+
+
+def main(args):
+    size = int(args.size_mb * 1024 * 1024)
+    part_size = int(args.part_mb * 1024 * 1024)
+    upload = FakeUpload(size, args.seed)
+    source = FakeUpload(size, args.seed)
+    client = FakeS3(args.latency_ms / 1000)
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    result = asyncio.run(upload_stream(upload, "bench/file", part_size, args.concurrency, client=client))
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    # Expected digests, recomputed from the same generator one part at a time
+    whole, expected = hashlib.sha256(), {}
+    for number, offset in enumerate(range(0, size, part_size), start=1):
+        data = source.chunk(offset, part_size)
+        whole.update(data)
+        expected[number] = (len(data), hashlib.sha256(data).hexdigest())
+
+    checks = {
+        "sha256": result.sha256 == whole.hexdigest(),
+        "size": result.size == size,
+        "parts": result.parts == len(expected),
+        # One part is a single PUT, more a completed multipart upload
+        "part contents": (
+            client.objects.get("bench/file") == expected[1][1] if len(expected) == 1
+            else client.parts == expected and client.completed == sorted(expected)
+        ),
+        "in flight <= concurrency": client.peak_in_flight <= args.concurrency,
+        "not aborted": not client.aborted
+    }
+    print(f"{args.size_mb} MB in {result.parts} parts of {args.part_mb} MB, concurrency {args.concurrency}, "
+          f"{args.latency_ms} ms per part")
+    print(f"throughput       {size / 2**20 / elapsed:.1f} MB/s ({elapsed:.2f}s)")
+    print(f"peak in flight   {client.peak_in_flight}")
+    print(f"peak memory      {peak / 2**20:.1f} MB (~{peak / part_size:.1f} parts)")
+    for name, ok in checks.items():
+        print(f"{name:<26}{'ok' if ok else 'FAILED'}")
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming S3 upload benchmark")
+    parser.add_argument("--size-mb", type=float, default=256)
+    parser.add_argument("--part-mb", type=float, default=8)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
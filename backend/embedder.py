@@ -0,0 +1,215 @@
+"""Embedding providers and a batching, concurrent embedder."""
+import asyncio
+import hashlib
+import os
+import re
+import zlib
+from typing import List, Optional
+
+import numpy as np
+
+from embedding_store import EMBEDDING_DIM
+
+# Configuration
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")  # openai | local | fake
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "8000"))
+EMBED_BATCH_MAX_ITEMS = int(os.getenv("EMBED_BATCH_MAX_ITEMS", "256"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return max(1, len(text) // 4)
+
+
+class EmbeddingProvider:
+    """Turns a batch of texts into a (len(texts), dim) float32 matrix"""
+    dim = EMBEDDING_DIM
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """Embeddings from the OpenAI API, one request per batch"""
+
+    def __init__(self, model: str = EMBEDDING_MODEL, client=None):
+        self.model = model
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        return self._client
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        response = await self.client.embeddings.create(model=self.model, input=texts)
+        data = sorted(response.data, key=lambda item: item.index)
+        return np.array([item.embedding for item in data], dtype=np.float32)
+
+
+class FakeEmbeddingProvider(EmbeddingProvider):
+    """
+    Deterministic offline provider for tests and benchmarks.
+
+    Each text maps to a fixed pseudo-random unit vector seeded from its hash.
+    latency/per_item_latency simulate provider round trips.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, latency: float = 0.0, per_item_latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.calls = 0
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        self.calls += 1
+        delay = self.latency + self.per_item_latency * len(texts)
+        if delay:
+            await asyncio.sleep(delay)
+
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            vectors[i] = np.random.default_rng(seed).standard_normal(self.dim, dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """
+    CPU-only embeddings for offline and low-latency deployments.
+
+    Word unigrams, word bigrams and character trigrams are hashed into dim
+    signed buckets (a sparse random projection of the n-gram counts) with
+    sublinear term-frequency weights, then scaled to unit length. No corpus
+    statistics are kept, so vectors from any worker or restart stay
+    comparable with those already stored.
+    """
+
+    WORD_PATTERN = re.compile(r"[a-z0-9]+")
+    GOLDEN = np.uint64(0x9E3779B97F4A7C15)  # multiplicative hash constant
+    WORD_SALT, CHAR_SALT = np.uint64(0x5BD1E995), np.uint64(0xC2B2AE35)
+
+    def __init__(self, dim: int = EMBEDDING_DIM, word_weight: float = 1.0, char_weight: float = 0.5):
+        self.dim = dim
+        self.word_weight = word_weight
+        self.char_weight = char_weight
+
+    def _features(self, text: str):
+        words = self.WORD_PATTERN.findall(text.lower())
+        grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        word_codes = np.array([zlib.crc32(gram.encode()) for gram in grams], dtype=np.uint64)
+        # Exact 24-bit codes of every byte trigram, including word boundaries
+        padded = np.frombuffer(f" {' '.join(words)} ".encode(), dtype=np.uint8).astype(np.uint64)
+        char_codes = (padded[:-2] << np.uint64(16)) | (padded[1:-1] << np.uint64(8)) | padded[2:]
+        return word_codes, char_codes
+
+    def _accumulate(self, out: np.ndarray, rows: np.ndarray, codes: np.ndarray, salt: np.uint64, weight: float):
+        if not codes.size:
+            return
+        # Count each distinct feature per text in one pass over the whole batch
+        keys, counts = np.unique((rows << np.uint64(32)) | codes, return_counts=True)
+        mixed = ((keys & np.uint64(0xFFFFFFFF)) ^ salt) * self.GOLDEN
+        buckets = ((mixed >> np.uint64(32)) % np.uint64(self.dim)).astype(np.int64)
+        signs = np.where((mixed >> np.uint64(31)) & np.uint64(1), 1.0, -1.0)
+        flat = (keys >> np.uint64(32)).astype(np.int64) * self.dim + buckets
+        out += np.bincount(flat, weights=signs * weight * (1.0 + np.log(counts)), minlength=out.size)
+
+    def embed_sync(self, texts: List[str]) -> np.ndarray:
+        word_rows, word_codes, char_rows, char_codes = [], [], [], []
+        for row, text in enumerate(texts):
+            words, chars = self._features(text)
+            word_rows.append(np.full(words.size, row, dtype=np.uint64))
+            word_codes.append(words)
+            char_rows.append(np.full(chars.size, row, dtype=np.uint64))
+            char_codes.append(chars)
+
+        out = np.zeros(len(texts) * self.dim, dtype=np.float64)
+        if texts:
+            self._accumulate(out, np.concatenate(word_rows), np.concatenate(word_codes), self.WORD_SALT, self.word_weight)
+            self._accumulate(out, np.concatenate(char_rows), np.concatenate(char_codes), self.CHAR_SALT, self.char_weight)
+        vectors = out.reshape(len(texts), self.dim).astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        # CPU-bound: keep the event loop free, batches run in parallel threads
+        return await asyncio.to_thread(self.embed_sync, texts)
+
+
+class BatchingEmbedder:
+    """
+    Packs texts into provider requests up to a token budget and runs the
+    requests concurrently, at most max_concurrency in flight.
+    """
+
+    def __init__(
+        self,
+        provider: EmbeddingProvider,
+        max_batch_tokens: int = EMBED_BATCH_TOKENS,
+        max_batch_items: int = EMBED_BATCH_MAX_ITEMS,
+        max_concurrency: int = EMBED_CONCURRENCY
+    ):
+        self.provider = provider
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.max_concurrency = max_concurrency
+
+    def make_batches(self, texts: List[str]) -> List[List[int]]:
+        """Group text indices so each batch stays within the token and item limits"""
+        batches = []
+        current, current_tokens = [], 0
+        for i, text in enumerate(texts):
+            tokens = estimate_tokens(text)
+            if current and (
+                current_tokens + tokens > self.max_batch_tokens
+                or len(current) >= self.max_batch_items
+            ):
+                batches.append(current)
+                current, current_tokens = [], 0
+            # An oversized text still goes out, alone in its batch
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts, returning vectors in the same order"""
+        result = np.empty((len(texts), self.provider.dim), dtype=np.float32)
+        if not texts:
+            return result
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(batch: List[int]):
+            async with semaphore:
+                vectors = await self.provider.embed([texts[i] for i in batch])
+            result[batch] = vectors
+
+        await asyncio.gather(*(run(batch) for batch in self.make_batches(texts)))
+        return result
+
+    async def embed_one(self, text: str) -> np.ndarray:
+        return (await self.provider.embed([text]))[0]
+
+
+def get_embedding_provider(name: Optional[str] = None) -> EmbeddingProvider:
+    """Provider selected by EMBEDDING_PROVIDER"""
+    name = (name or EMBEDDING_PROVIDER).lower()
+    if name == "openai":
+        return OpenAIEmbeddingProvider()
+    if name == "local":
+        return LocalEmbeddingProvider()
+    if name == "fake":
+        return FakeEmbeddingProvider()
+    raise ValueError(f"Unknown embedding provider: {name}")
+
+
+# Shared embedder used by the AI routes
+embedder = BatchingEmbedder(get_embedding_provider())
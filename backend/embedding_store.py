@@ -0,0 +1,59 @@
+"""Storage format for chunk embeddings (packed float32 bytes or pgvector)."""
+import json
+import os
+
+import numpy as np
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+try:
+    from pgvector.sqlalchemy import Vector
+except ImportError:  # pgvector is optional
+    Vector = None
+
+EMBEDDING_DIM = 1536
+EMBEDDING_DTYPE = np.dtype("<f4")  # little-endian float32, 6KB per 1536-dim vector
+
+# Store vectors in a native pgvector column instead of bytea (requires the pgvector package)
+USE_PGVECTOR = os.getenv("USE_PGVECTOR", "false").lower() == "true"
+
+
+def encode_vector(vector) -> bytes:
+    """Pack a vector as raw little-endian float32 bytes"""
+    return np.ascontiguousarray(vector, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def decode_vector(blob) -> np.ndarray:
+    """View packed bytes as a read-only float32 array without copying"""
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE)
+
+
+def row_vector(vector, embedding_json=None) -> np.ndarray:
+    """Vector of an embeddings row, falling back to the legacy JSON column"""
+    if vector is not None:
+        return np.asarray(vector, dtype=np.float32)
+    return np.array(json.loads(embedding_json), dtype=np.float32)
+
+
+class PackedVector(TypeDecorator):
+    """bytea/BLOB column holding a float32 vector, returned as a NumPy array"""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return encode_vector(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decode_vector(value)
+
+
+def vector_column_type():
+    """Column type for embedding vectors (pgvector when enabled and installed)"""
+    if USE_PGVECTOR:
+        if Vector is None:
+            raise RuntimeError("USE_PGVECTOR is set but the pgvector package is not installed")
+        return Vector(EMBEDDING_DIM)
+    return PackedVector()
@@ -0,0 +1,240 @@
+"""
+On-disk vector index snapshots shared by every worker on a host.
+
+    VECTOR_INDEX_SNAPSHOT_DIR/
+        CURRENT         number of the live generation, replaced atomically
+        gen-<n>/        immutable snapshot, .npy arrays opened with mmap
+            vectors.npy     float32 (rows, dim) unit vectors
+            codes.npy       quantized first-pass codes (int8 / binary modes)
+            scales.npy      per-row int8 scales (int8 mode)
+            ids.npy         uint8 (rows, 4, 16): embedding, record, chunk, patient ids
+            meta.json       dim, quantization, rows, watermark
+        gen-<n>.log     append-only changes made after gen-<n> was written
+        .lock           flock held while appending to the log or compacting
+
+Workers map the arrays read-only, so the page cache holds one copy of the
+vectors however many processes serve searches. Changes are appended to the
+log of the current generation and replayed by the other workers; compaction
+folds them into the next generation.
+"""
+import fcntl
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+from uuid import UUID
+
+import numpy as np
+
+ADD, REMOVE = b"A", b"D"
+NIL_ID = bytes(16)  # embeddings without a chunk
+
+
+def encode_ids(*columns) -> np.ndarray:
+    """(rows, len(columns), 16) uint8 from parallel lists of UUIDs (None allowed)"""
+    rows = len(columns[0])
+    raw = b"".join(
+        (value.bytes if value is not None else NIL_ID)
+        for row in range(rows) for value in (column[row] for column in columns)
+    )
+    return np.frombuffer(raw, dtype=np.uint8).reshape(rows, len(columns), 16)
+
+
+def decode_ids(raw: np.ndarray) -> List[np.ndarray]:
+    """Object arrays of UUIDs (None for nil), one per column of encode_ids"""
+    columns = []
+    for column in range(raw.shape[1]):
+        packed = np.ascontiguousarray(raw[:, column]).tobytes()
+        values = [packed[i:i + 16] for i in range(0, len(packed), 16)]
+        columns.append(np.array(
+            [UUID(bytes=value) if value != NIL_ID else None for value in values], dtype=object
+        ))
+    return columns
+
+
+@dataclass
+class Snapshot:
+    """One generation, mapped read-only"""
+    generation: int
+    dim: int
+    quantization: str
+    watermark: Optional[datetime]
+    vectors: np.ndarray
+    codes: Optional[np.ndarray]
+    scales: Optional[np.ndarray]
+    ids: np.ndarray
+    record_ids: np.ndarray
+    chunk_ids: np.ndarray
+    patient_ids: np.ndarray
+
+    @property
+    def rows(self) -> int:
+        return self.vectors.shape[0]
+
+
+class SnapshotWriter:
+    """Arrays of a generation being written; the index fills them, then publish()"""
+
+    def __init__(self, path: str, rows: int, dim: int, quantization: str, watermark: Optional[datetime]):
+        self.path = path
+        self.meta = {
+            "dim": dim,
+            "quantization": quantization,
+            "rows": rows,
+            "watermark": watermark.isoformat() if watermark else None
+        }
+        os.makedirs(path)
+        shape = (rows, dim)
+        self.vectors = np.lib.format.open_memmap(os.path.join(path, "vectors.npy"), "w+", np.float32, shape)
+        self.ids = np.lib.format.open_memmap(os.path.join(path, "ids.npy"), "w+", np.uint8, (rows, 4, 16))
+        self.codes = self.scales = None
+        if quantization == "int8":
+            self.codes = np.lib.format.open_memmap(os.path.join(path, "codes.npy"), "w+", np.int8, shape)
+            self.scales = np.lib.format.open_memmap(os.path.join(path, "scales.npy"), "w+", np.float32, (rows,))
+        elif quantization == "binary":
+            self.codes = np.lib.format.open_memmap(
+                os.path.join(path, "codes.npy"), "w+", np.uint8, (rows, (dim + 7) // 8)
+            )
+
+    def finish(self):
+        for array in (self.vectors, self.ids, self.codes, self.scales):
+            if array is not None:
+                array.flush()
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(self.meta, f)
+
+
+class SnapshotStore:
+    """Generations, delta logs and the cross-process lock in one directory"""
+
+    def __init__(self, directory: str, dim: int):
+        self.directory = directory
+        self.dim = dim
+        # op + embedding/record/chunk/patient ids + vector, or op + record id
+        self.add_size = 1 + 4 * 16 + 4 * dim
+        self.remove_size = 1 + 16
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def log_path(self, generation: int) -> str:
+        return self._path(f"gen-{generation}.log")
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        """Serialize log appends and compaction across processes"""
+        with open(self._path(".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def current_generation(self) -> Optional[int]:
+        try:
+            with open(self._path("CURRENT")) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def open(self, generation: int) -> Snapshot:
+        path = self._path(f"gen-{generation}")
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+
+        def load(name):
+            file = os.path.join(path, name)
+            return np.load(file, mmap_mode="r") if os.path.exists(file) else None
+
+        ids, record_ids, chunk_ids, patient_ids = decode_ids(load("ids.npy"))
+        return Snapshot(
+            generation=generation,
+            dim=meta["dim"],
+            quantization=meta["quantization"],
+            watermark=datetime.fromisoformat(meta["watermark"]) if meta["watermark"] else None,
+            vectors=load("vectors.npy"),
+            codes=load("codes.npy"),
+            scales=load("scales.npy"),
+            ids=ids,
+            record_ids=record_ids,
+            chunk_ids=chunk_ids,
+            patient_ids=patient_ids
+        )
+
+    def create(self, generation: int, rows: int, quantization: str, watermark: Optional[datetime]) -> SnapshotWriter:
+        path = self._path(f"gen-{generation}.tmp")
+        shutil.rmtree(path, ignore_errors=True)  # left by a crashed compaction
+        return SnapshotWriter(path, rows, self.dim, quantization, watermark)
+
+    def publish(self, generation: int, writer: SnapshotWriter):
+        """Make a finished generation current (caller holds exclusive())"""
+        writer.finish()
+        os.replace(writer.path, self._path(f"gen-{generation}"))
+        open(self.log_path(generation), "ab").close()
+        pointer = self._path("CURRENT.tmp")
+        with open(pointer, "w") as f:
+            f.write(str(generation))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer, self._path("CURRENT"))
+        # Keep the previous generation for workers still switching over;
+        # mappings of deleted files stay valid in processes that hold them
+        for name in os.listdir(self.directory):
+            if name.startswith("gen-"):
+                number = name[4:].split(".")[0]
+                if number.isdigit() and int(number) < generation - 1:
+                    path = self._path(name)
+                    shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+
+    def append(self, entries: bytes):
+        """Append encoded entries to the current generation's log"""
+        if not entries:
+            return
+        with self.exclusive():
+            generation = self.current_generation()
+            if generation is None:
+                return  # nothing to replay onto yet; the first snapshot reads the table
+            with open(self.log_path(generation), "ab") as log:
+                log.write(entries)
+
+    def encode_add(self, ids, record_ids, chunk_ids, patient_ids, vectors: np.ndarray) -> bytes:
+        raw = encode_ids(ids, record_ids, chunk_ids, patient_ids).reshape(len(ids), -1)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        return b"".join(ADD + raw[i].tobytes() + vectors[i].tobytes() for i in range(len(ids)))
+
+    def encode_remove(self, record_id: UUID) -> bytes:
+        return REMOVE + record_id.bytes
+
+    def read_log(self, generation: int, offset: int) -> Tuple[list, int]:
+        """
+        Entries after offset as ("A", ids tuple, vector) / ("D", record_id),
+        and the offset to resume from. A partly written tail is left for later.
+        """
+        try:
+            with open(self.log_path(generation), "rb") as log:
+                log.seek(offset)
+                data = log.read()
+        except FileNotFoundError:
+            return [], offset
+
+        entries, position = [], 0
+        while position < len(data):
+            op = data[position:position + 1]
+            size = self.add_size if op == ADD else self.remove_size
+            if position + size > len(data):
+                break
+            body = data[position + 1:position + size]
+            if op == ADD:
+                ids = decode_ids(np.frombuffer(body[:64], dtype=np.uint8).reshape(1, 4, 16))
+                vector = np.frombuffer(body[64:], dtype=np.float32)
+                entries.append((ADD, tuple(column[0] for column in ids), vector))
+            elif op == REMOVE:
+                entries.append((REMOVE, UUID(bytes=body)))
+            else:
+                raise ValueError(f"Corrupt vector index log {self.log_path(generation)} at {offset + position}")
+            position += size
+        return entries, offset + position
@@ -0,0 +1,391 @@
+"""
+Background ingestion pipeline: extract -> chunk -> embed -> index.
+
+Jobs live in the ingestion_jobs table, so they survive restarts and are
+shared by every worker process. A job runs one stage at a time and is
+re-queued for the next stage, which lets different workers work on
+different stages of different records at once.
+"""
+import asyncio
+import io
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from uuid import UUID, uuid4
+
+import numpy as np
+from sqlalchemy import insert, or_
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from embedder import embedder
+from invalidation import invalidations
+from metrics import metrics
+from models import (
+    Embedding, FileTypeEnum, IngestionJob, IngestionStageEnum, JobStatusEnum,
+    Record, RecordStatusEnum, RecordText
+)
+from storage import download_file
+from vector_index import vector_index
+from lexical_index import lexical_index
+from answer_cache import answer_cache
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # PDF text extraction is optional
+    PdfReader = None
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+INGESTION_MAX_PENDING = int(os.getenv("INGESTION_MAX_PENDING", "500"))
+INGESTION_MAX_ATTEMPTS = int(os.getenv("INGESTION_MAX_ATTEMPTS", "3"))
+INGESTION_POLL_SECONDS = float(os.getenv("INGESTION_POLL_SECONDS", "2"))
+INGESTION_LEASE_SECONDS = int(os.getenv("INGESTION_LEASE_SECONDS", "600"))
+CHUNK_CHARS = int(os.getenv("CHUNK_CHARS", "2000"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+CLAIM_ATTEMPTS = 3  # candidates tried per poll when other workers lease them first
+
+NEXT_STAGE = {
+    IngestionStageEnum.EXTRACT: IngestionStageEnum.CHUNK,
+    IngestionStageEnum.CHUNK: IngestionStageEnum.EMBED,
+    IngestionStageEnum.EMBED: IngestionStageEnum.INDEX,
+    IngestionStageEnum.INDEX: None,
+}
+
+
+class IngestionBackpressure(Exception):
+    """Raised when too many records are already waiting to be processed"""
+
+
+# Text processing
+
+def extract_text(file_type: FileTypeEnum, data: bytes) -> str:
+    """Plain text of an uploaded file ("" when the type needs OCR)"""
+    if file_type == FileTypeEnum.PDF:
+        if PdfReader is None:
+            return ""
+        reader = PdfReader(io.BytesIO(data))
+        return "\n".join(page.extract_text() or "" for page in reader.pages)
+    if file_type == FileTypeEnum.REPORT:
+        if b"\x00" in data[:1024]:  # binary document format
+            return ""
+        return data.decode("utf-8", errors="ignore")
+    # Images and DICOM need OCR, which is not wired up yet
+    return ""
+
+
+def chunk_text(text: str, size: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """Split text into overlapping chunks, breaking on whitespace where possible"""
+    text = text.strip()
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            space = text.rfind(" ", start + size // 2, end)
+            if space != -1:
+                end = space
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+# Embedding storage (shared with the /api/ai/embed route)
+
+def store_embeddings(db: Session, record_id: UUID, chunk_ids: List[UUID], vectors: np.ndarray) -> List[UUID]:
+    """Replace a record's embeddings with one multi-row INSERT, returns new ids"""
+    db.query(Embedding).filter(Embedding.record_id == record_id).delete(synchronize_session=False)
+    ids = [uuid4() for _ in chunk_ids]
+    if ids:
+        db.execute(insert(Embedding), [
+            {"id": emb_id, "record_id": record_id, "chunk_id": chunk_id, "vector": vector}
+            for emb_id, chunk_id, vector in zip(ids, chunk_ids, vectors)
+        ])
+    # Workers holding the old rows in their search indexes reload the record
+    invalidations.publish(db, "record_index", record_id)
+    db.commit()
+    return ids
+
+
+# Job queue
+
+def check_capacity(db: Session):
+    """Refuse new work when the queue is over INGESTION_MAX_PENDING"""
+    pending = db.query(IngestionJob).filter(
+        IngestionJob.status.in_([JobStatusEnum.QUEUED, JobStatusEnum.RUNNING])
+    ).count()
+    if pending >= INGESTION_MAX_PENDING:
+        metrics.incr("ingestion.rejected")
+        raise IngestionBackpressure(f"{pending} records are waiting to be processed")
+
+
+def enqueue_record(db: Session, record_id: UUID) -> IngestionJob:
+    """
+    Queue a record for processing in the caller's transaction, so the job
+    commits together with the record. Call ingestion_pool.notify() after
+    the commit to wake this process's workers.
+    """
+    job = IngestionJob(record_id=record_id)
+    db.add(job)
+    metrics.incr("ingestion.enqueued")
+    return job
+
+
+def claim_next_job() -> Optional[Tuple[UUID, UUID, IngestionStageEnum]]:
+    """Lease the next runnable job, returns (job_id, record_id, stage)"""
+    db = SessionLocal()
+    try:
+        for _ in range(CLAIM_ATTEMPTS):
+            now = datetime.utcnow()
+            query = db.query(
+                IngestionJob.id, IngestionJob.record_id, IngestionJob.stage,
+                IngestionJob.status, IngestionJob.locked_at
+            ).filter(
+                or_(
+                    (IngestionJob.status == JobStatusEnum.QUEUED) & (IngestionJob.available_at <= now),
+                    # Lease expired: the worker holding it died
+                    (IngestionJob.status == JobStatusEnum.RUNNING)
+                    & (IngestionJob.locked_at < now - timedelta(seconds=INGESTION_LEASE_SECONDS))
+                )
+            ).order_by(IngestionJob.available_at)
+            if db.bind.dialect.name == "postgresql":
+                query = query.with_for_update(skip_locked=True)
+            job = query.first()
+            if job is None:
+                return None
+
+            # Only if nobody leased it since we read it (no row locks outside PostgreSQL)
+            leased = db.query(IngestionJob).filter(
+                IngestionJob.id == job.id,
+                IngestionJob.status == job.status,
+                IngestionJob.locked_at.is_not_distinct_from(job.locked_at)
+            ).update({
+                IngestionJob.status: JobStatusEnum.RUNNING,
+                IngestionJob.locked_at: now,
+                IngestionJob.attempts: IngestionJob.attempts + 1
+            }, synchronize_session=False)
+            if leased == 0:
+                db.rollback()
+                metrics.incr("ingestion.claim_conflicts")
+                continue
+            if job.stage == IngestionStageEnum.EXTRACT:
+                db.query(Record).filter(Record.id == job.record_id).update(
+                    {Record.status: RecordStatusEnum.PROCESSING}, synchronize_session=False
+                )
+            db.commit()
+            return job.id, job.record_id, job.stage
+        return None
+    finally:
+        db.close()
+
+
+def _advance(job_id: UUID, stage: IngestionStageEnum):
+    db = SessionLocal()
+    try:
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+        if job is None:  # record deleted mid-pipeline
+            return
+        next_stage = NEXT_STAGE[stage]
+        if next_stage is None:
+            job.status = JobStatusEnum.DONE
+            db.query(Record).filter(Record.id == job.record_id).update(
+                {Record.status: RecordStatusEnum.PROCESSED}, synchronize_session=False
+            )
+            metrics.incr("ingestion.completed")
+        else:
+            job.stage = next_stage
+            job.status = JobStatusEnum.QUEUED
+            job.attempts = 0
+            job.available_at = datetime.utcnow()
+        job.locked_at = None
+        job.last_error = None
+        db.commit()
+    finally:
+        db.close()
+
+
+def _fail(job_id: UUID, error: str):
+    db = SessionLocal()
+    try:
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+        if job is None:
+            return
+        job.last_error = error
+        job.locked_at = None
+        if job.attempts >= INGESTION_MAX_ATTEMPTS:
+            job.status = JobStatusEnum.FAILED
+            db.query(Record).filter(Record.id == job.record_id).update(
+                {Record.status: RecordStatusEnum.FAILED}, synchronize_session=False
+            )
+            metrics.incr("ingestion.failed")
+        else:
+            job.status = JobStatusEnum.QUEUED
+            job.available_at = datetime.utcnow() + timedelta(seconds=2 ** job.attempts)
+            metrics.incr("ingestion.retried")
+        db.commit()
+    finally:
+        db.close()
+
+
+# Stages
+
+def _run_extract(job_id: UUID, record_id: UUID):
+    db = SessionLocal()
+    try:
+        record = db.query(Record).filter(Record.id == record_id).first()
+        if record is None:
+            return
+        text = extract_text(record.file_type, download_file(record.file_url))
+        db.query(IngestionJob).filter(IngestionJob.id == job_id).update(
+            {IngestionJob.extracted_text: text}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _run_chunk(job_id: UUID, record_id: UUID):
+    db = SessionLocal()
+    try:
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+        if job is None:
+            return
+        chunks = chunk_text(job.extracted_text or "")
+        # Replace chunks from any earlier attempt
+        db.query(RecordText).filter(RecordText.record_id == record_id).delete(synchronize_session=False)
+        if chunks:
+            db.execute(insert(RecordText), [
+                {"id": uuid4(), "record_id": record_id, "extracted_text": chunk, "chunk_index": i}
+                for i, chunk in enumerate(chunks)
+            ])
+        job.extracted_text = None
+        invalidations.publish(db, "record_index", record_id)
+        db.commit()
+        # Answers generated from the old text; other workers see the version change
+        answer_cache.invalidate_record(record_id)
+    finally:
+        db.close()
+
+
+def _load_chunks(record_id: UUID) -> List[Tuple[UUID, str]]:
+    db = SessionLocal()
+    try:
+        rows = db.query(RecordText.id, RecordText.extracted_text).filter(
+            RecordText.record_id == record_id
+        ).order_by(RecordText.chunk_index).all()
+        return [(row.id, row.extracted_text) for row in rows]
+    finally:
+        db.close()
+
+
+def _store_embeddings(record_id: UUID, chunk_ids: List[UUID], vectors: np.ndarray):
+    db = SessionLocal()
+    try:
+        store_embeddings(db, record_id, chunk_ids, vectors)
+    finally:
+        db.close()
+
+
+async def _run_embed(job_id: UUID, record_id: UUID):
+    chunks = await asyncio.to_thread(_load_chunks, record_id)
+    vectors = await embedder.embed([text for _, text in chunks])
+    await asyncio.to_thread(_store_embeddings, record_id, [chunk_id for chunk_id, _ in chunks], vectors)
+
+
+def _run_index(job_id: UUID, record_id: UUID):
+    db = SessionLocal()
+    try:
+        vector_index.reload_record(db, record_id)
+        lexical_index.reload_record(db, record_id)
+    finally:
+        db.close()
+    vector_index.maybe_compact()
+
+
+STAGES = {
+    IngestionStageEnum.EXTRACT: _run_extract,
+    IngestionStageEnum.CHUNK: _run_chunk,
+    IngestionStageEnum.EMBED: _run_embed,
+    IngestionStageEnum.INDEX: _run_index,
+}
+
+
+class IngestionWorkerPool:
+    """asyncio workers that pull jobs from the ingestion_jobs table"""
+
+    def __init__(self, workers: int = INGESTION_WORKERS):
+        self.workers = workers
+        self.busy = 0
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    def start(self):
+        if self._tasks or self.workers <= 0:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self, grace_seconds: float = 30):
+        """Let in-flight stages finish, then cancel (unfinished jobs are re-leased later)"""
+        self._stopping = True
+        self.notify()
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=grace_seconds)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle workers in this process (others pick jobs up on their next poll)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                claimed = await asyncio.to_thread(claim_next_job)
+            except Exception:
+                logger.exception("Could not claim ingestion job")
+                claimed = None
+            if claimed is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), INGESTION_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._process(*claimed)
+
+    async def _process(self, job_id: UUID, record_id: UUID, stage: IngestionStageEnum):
+        self.busy += 1
+        start = time.perf_counter()
+        try:
+            run = STAGES[stage]
+            if asyncio.iscoroutinefunction(run):
+                await run(job_id, record_id)
+            else:
+                await asyncio.to_thread(run, job_id, record_id)
+            await asyncio.to_thread(_advance, job_id, stage)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.exception("Ingestion stage %s failed for record %s", stage.value, record_id)
+            await asyncio.to_thread(_fail, job_id, f"{stage.value}: {exc}")
+        finally:
+            metrics.observe(f"ingestion.stage.{stage.value}", time.perf_counter() - start)
+            self.busy -= 1
+
+
+ingestion_pool = IngestionWorkerPool()
+metrics.register_gauge("ingestion.workers_busy", lambda: ingestion_pool.busy)
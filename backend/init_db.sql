@@ -9,7 +9,7 @@ EXCEPTION
 END $$;
 
 DO $$ BEGIN
-    CREATE TYPE record_status AS ENUM ('pending', 'processing', 'processed');
+    CREATE TYPE record_status AS ENUM ('pending', 'processing', 'processed', 'failed');
 EXCEPTION
     WHEN duplicate_object THEN null;
 END $$;
@@ -20,14 +20,53 @@ EXCEPTION
     WHEN duplicate_object THEN null;
 END $$;
 
+-- Trigram indexes for substring patient search (ILIKE '%q%')
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Create indexes for performance
 CREATE INDEX IF NOT EXISTS idx_users_phone ON users(phone);
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
+CREATE INDEX IF NOT EXISTS ix_users_created_at ON users(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_user_roles_user_id ON user_roles(user_id);
 CREATE INDEX IF NOT EXISTS idx_patients_medical_id ON patients(medical_id);
+CREATE INDEX IF NOT EXISTS ix_patients_first_name_trgm ON patients USING gin (first_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_patients_last_name_trgm ON patients USING gin (last_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_patients_medical_id_trgm ON patients USING gin (medical_id gin_trgm_ops);
 CREATE INDEX IF NOT EXISTS idx_records_patient_id ON records(patient_id);
+CREATE INDEX IF NOT EXISTS ix_records_patient_upload_date ON records(patient_id, upload_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ix_records_upload_date ON records(upload_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ix_record_texts_record_chunk ON record_texts(record_id, chunk_index);
+CREATE INDEX IF NOT EXISTS ix_record_texts_created_at ON record_texts(created_at);
+CREATE INDEX IF NOT EXISTS ix_embeddings_created_at ON embeddings(created_at);
+CREATE INDEX IF NOT EXISTS ix_shared_access_doctor_expires ON shared_access(doctor_id, expires_at);
+CREATE INDEX IF NOT EXISTS ix_manager_action_otps_lookup ON manager_action_otps(manager_id, action, otp, verified, expires_at);
+CREATE INDEX IF NOT EXISTS ix_manager_action_otps_expires_at ON manager_action_otps(expires_at);
+CREATE INDEX IF NOT EXISTS ix_cache_invalidations_created_at ON cache_invalidations(created_at);
 CREATE INDEX IF NOT EXISTS idx_audit_logs_user_id ON access_logs(user_id);
 CREATE INDEX IF NOT EXISTS idx_audit_logs_timestamp ON access_logs(timestamp DESC);
 
+-- Short excerpt column used by search results (tables created before it existed)
+ALTER TABLE record_texts ADD COLUMN IF NOT EXISTS excerpt VARCHAR(200);
+UPDATE record_texts SET excerpt = LEFT(extracted_text, 200) WHERE excerpt IS NULL;
+
+-- Stored full-text document for keyword search (tables created before it existed);
+-- the configuration must match SEARCH_TS_CONFIG in models.py
+ALTER TABLE record_texts ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', extracted_text)) STORED;
+CREATE INDEX IF NOT EXISTS ix_record_texts_search_vector ON record_texts USING gin (search_vector);
+-- Replaced by ix_record_texts_search_vector
+DROP INDEX IF EXISTS ix_record_texts_tsv;
+
+-- Upload checksum column (tables created before it existed)
+ALTER TABLE records ADD COLUMN IF NOT EXISTS checksum_sha256 VARCHAR(64);
+
 -- Enable Row Level Security (optional - implement as needed)
 -- ALTER TABLE patients ENABLE ROW LEVEL SECURITY;
 -- ALTER TABLE records ENABLE ROW LEVEL SECURITY;
+
+-- Failed ingestion status (record status enums created before it existed)
+DO $$ BEGIN
+    ALTER TYPE recordstatusenum ADD VALUE IF NOT EXISTS 'FAILED';
+EXCEPTION
+    WHEN undefined_object THEN null;
+END $$;
@@ -0,0 +1,99 @@
+"""
+Cache invalidation shared by every worker process.
+
+A change that makes cached entries stale records (cache, key) rows in the
+cache_invalidations table, in the same transaction as the change. Each
+worker reads new rows at most every CACHE_INVALIDATION_POLL_SECONDS and drops
+the keys from its own caches, so a revoked role or share stops working
+everywhere within that interval instead of after the cache TTL.
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SessionLocal
+from metrics import metrics
+from models import CacheInvalidation
+
+# Configuration
+CACHE_INVALIDATION_POLL_SECONDS = float(os.getenv("CACHE_INVALIDATION_POLL_SECONDS", "1"))
+# Each poll re-reads this far behind the newest row seen, for rows that committed late
+CACHE_INVALIDATION_OVERLAP_SECONDS = float(os.getenv("CACHE_INVALIDATION_OVERLAP_SECONDS", "60"))
+CACHE_INVALIDATION_RETENTION_SECONDS = 3600
+
+
+class InvalidationChannel:
+    """Named cache handlers plus the position reached in cache_invalidations"""
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Callable[[str], None]]] = {}
+        self._seen: Dict[int, datetime] = {}  # ids applied within the overlap window
+        self._watermark = datetime.utcnow()  # caches start empty, older rows do not matter
+        self._polled_at = 0.0
+        self._pruned_at = time.monotonic()
+
+    def subscribe(self, cache: str, handler: Callable[[str], None]):
+        self._handlers.setdefault(cache, []).append(handler)
+
+    def _apply(self, cache: str, key: str) -> bool:
+        handlers = self._handlers.get(cache, ())
+        for handler in handlers:
+            handler(key)
+        return bool(handlers)
+
+    def publish(self, db, cache: str, key):
+        """
+        Drop key from this worker's cache now and queue the row in db's
+        transaction; other workers drop it once the caller commits.
+        """
+        db.add(CacheInvalidation(cache=cache, key=str(key)))
+        self._apply(cache, str(key))
+
+    async def poll(self, db: AsyncSession):
+        """Apply rows committed by any worker since the last poll (rate limited)"""
+        now = time.monotonic()
+        if now - self._polled_at < CACHE_INVALIDATION_POLL_SECONDS:
+            return
+        self._polled_at = now
+
+        since = self._watermark - timedelta(seconds=CACHE_INVALIDATION_OVERLAP_SECONDS)
+        rows = (await db.execute(
+            select(CacheInvalidation.id, CacheInvalidation.cache, CacheInvalidation.key, CacheInvalidation.created_at)
+            .where(CacheInvalidation.created_at >= since)
+        )).all()
+        applied = 0
+        for row in rows:
+            if row.id in self._seen:
+                continue
+            # Rows published by this worker are applied again, which also covers
+            # an entry cached between publish() and the commit
+            if self._apply(row.cache, row.key):
+                applied += 1
+            self._seen[row.id] = row.created_at
+            self._watermark = max(self._watermark, row.created_at)
+        metrics.incr("cache_invalidation.applied", applied)
+
+        cutoff = self._watermark - timedelta(seconds=CACHE_INVALIDATION_OVERLAP_SECONDS)
+        self._seen = {row_id: stamp for row_id, stamp in self._seen.items() if stamp >= cutoff}
+
+        if now - self._pruned_at >= CACHE_INVALIDATION_RETENTION_SECONDS:
+            self._pruned_at = now
+            await asyncio.to_thread(self._prune)
+
+    @staticmethod
+    def _prune():
+        db = SessionLocal()
+        try:
+            cutoff = datetime.utcnow() - timedelta(seconds=CACHE_INVALIDATION_RETENTION_SECONDS)
+            db.execute(delete(CacheInvalidation).where(CacheInvalidation.created_at < cutoff))
+            db.commit()
+        finally:
+            db.close()
+
+
+invalidations = InvalidationChannel()
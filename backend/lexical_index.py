@@ -0,0 +1,246 @@
+"""
+Keyword retrieval over record chunks, used alongside vector search.
+
+On PostgreSQL, chunks are matched with full-text search on the stored
+record_texts.search_vector column (GIN indexed, see models.py) and ranked
+with ts_rank_cd. Other backends use
+LexicalIndex, an in-process BM25 inverted index kept in step with
+record_texts the same way VectorIndex follows embeddings.
+"""
+import asyncio
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from invalidation import invalidations
+from models import Record, RecordText, SEARCH_TS_CONFIG
+
+# Configuration
+LEXICAL_SYNC_SECONDS = float(os.getenv("LEXICAL_INDEX_SYNC_SECONDS", "30"))
+# Re-read this far behind the watermark for chunks that committed late
+LEXICAL_SYNC_OVERLAP_SECONDS = float(os.getenv("LEXICAL_INDEX_SYNC_OVERLAP_SECONDS", "300"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Keeps codes such as "e11.9", "hba1c" or "covid-19" as single tokens
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class LexicalIndex:
+    """BM25 postings: term -> {chunk_id: term frequency}"""
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._stale = set()  # records whose chunks changed, reloaded on the next ensure_loaded
+        self._reset()
+
+    def _reset(self):
+        self._postings: Dict[str, Dict[UUID, int]] = defaultdict(dict)
+        self._docs: Dict[UUID, Tuple[UUID, UUID, int]] = {}  # chunk -> (record, patient, length)
+        self._doc_terms: Dict[UUID, Tuple[str, ...]] = {}  # chunk -> its distinct terms, for removal
+        self._chunks_by_record: Dict[UUID, Set[UUID]] = defaultdict(set)
+        self._total_length = 0
+        self._watermark = None
+        self._synced_at = 0.0
+        self._loaded = False
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    @staticmethod
+    def _row_query(db: Session):
+        return db.query(
+            RecordText.id,
+            RecordText.record_id,
+            Record.patient_id,
+            RecordText.extracted_text,
+            RecordText.created_at
+        ).join(Record, Record.id == RecordText.record_id)
+
+    def load(self, db: Session):
+        """Rebuild from the record_texts table"""
+        rows = self._row_query(db).all()
+        with self._lock:
+            self._reset()
+            self._add_rows(rows)
+            self._synced_at = time.monotonic()
+            self._loaded = True
+
+    def ensure_loaded(self):
+        """Load on first use, then pull chunks added by other workers (blocking)"""
+        if self._loaded and not self._stale and time.monotonic() - self._synced_at < LEXICAL_SYNC_SECONDS:
+            return
+        with self._load_lock:
+            due = time.monotonic() - self._synced_at >= LEXICAL_SYNC_SECONDS
+            if self._loaded and not self._stale and not due:
+                return
+            db = SessionLocal()
+            try:
+                if not self._loaded:
+                    self._stale.clear()
+                    self.load(db)
+                else:
+                    if due:
+                        self.sync(db)
+                    while self._stale:
+                        self.reload_record(db, self._stale.pop())
+            finally:
+                db.close()
+
+    def mark_stale(self, record_id: UUID):
+        """A record's chunks were replaced or deleted, possibly by another worker"""
+        if self._loaded:
+            self._stale.add(record_id)
+
+    def sync(self, db: Session):
+        """Add chunks created since the last load/sync, minus the overlap window"""
+        query = self._row_query(db)
+        if self._watermark is not None:
+            since = self._watermark - timedelta(seconds=LEXICAL_SYNC_OVERLAP_SECONDS)
+            query = query.filter(RecordText.created_at >= since)
+        rows = query.all()
+        with self._lock:
+            self._add_rows([row for row in rows if row.id not in self._docs])
+            self._synced_at = time.monotonic()
+
+    def reload_record(self, db: Session, record_id: UUID):
+        """Replace a record's chunks with what is currently stored for it"""
+        if not self._loaded:
+            return
+        rows = self._row_query(db).filter(RecordText.record_id == record_id).all()
+        with self._lock:
+            self.remove_record(record_id)
+            self._add_rows(rows)
+
+    def _add_rows(self, rows):
+        for row in rows:
+            self.add(row.id, row.record_id, row.patient_id, row.extracted_text)
+            if row.created_at is not None and (self._watermark is None or row.created_at > self._watermark):
+                self._watermark = row.created_at
+
+    def add(self, chunk_id: UUID, record_id: UUID, patient_id: UUID, text: str):
+        terms = Counter(tokenize(text))
+        length = sum(terms.values())
+        with self._lock:
+            if chunk_id in self._docs:
+                return
+            for term, tf in terms.items():
+                self._postings[term][chunk_id] = tf
+            self._docs[chunk_id] = (record_id, patient_id, length)
+            self._doc_terms[chunk_id] = tuple(terms)
+            self._chunks_by_record[record_id].add(chunk_id)
+            self._total_length += length
+
+    def remove_record(self, record_id: UUID) -> int:
+        with self._lock:
+            chunk_ids = self._chunks_by_record.pop(record_id, set())
+            if not chunk_ids:
+                return 0
+            for chunk_id in chunk_ids:
+                self._total_length -= self._docs.pop(chunk_id)[2]
+                # Only the chunk's own postings, O(terms in the chunk)
+                for term in self._doc_terms.pop(chunk_id):
+                    postings = self._postings[term]
+                    del postings[chunk_id]
+                    if not postings:
+                        del self._postings[term]
+            return len(chunk_ids)
+
+    def search(
+        self,
+        query: str,
+        k: int = 100,
+        patient_ids: Optional[Iterable[UUID]] = None,
+        record_ids: Optional[Iterable[UUID]] = None
+    ) -> List[Tuple[UUID, UUID, float]]:
+        """(chunk_id, record_id, bm25 score) of the k best chunks in scope"""
+        allowed_patients = set(patient_ids) if patient_ids is not None else None
+        allowed_records = set(record_ids) if record_ids is not None else None
+        scores: Dict[UUID, float] = defaultdict(float)
+        with self._lock:
+            count = len(self._docs)
+            if count == 0:
+                return []
+            avg_length = self._total_length / count
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    record_id, patient_id, length = self._docs[chunk_id]
+                    if allowed_records is not None and record_id not in allowed_records:
+                        continue
+                    if allowed_patients is not None and patient_id not in allowed_patients:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+            ranked = sorted(scores.items(), key=lambda item: -item[1])[:k]
+            return [(chunk_id, self._docs[chunk_id][0], score) for chunk_id, score in ranked]
+
+
+# Process-wide fallback index (unused on PostgreSQL)
+lexical_index = LexicalIndex()
+invalidations.subscribe("record_index", lambda key: lexical_index.mark_stale(UUID(key)))
+
+
+async def lexical_search(
+    db: AsyncSession,
+    query: str,
+    k: int = 100,
+    patient_ids: Optional[Iterable[UUID]] = None,
+    record_ids: Optional[Iterable[UUID]] = None
+) -> List[Tuple[UUID, UUID, float]]:
+    """(chunk_id, record_id, score) of the k best keyword matches, best first"""
+    if (patient_ids is not None and not patient_ids) or (record_ids is not None and not record_ids):
+        return []
+
+    if db.get_bind().dialect.name != "postgresql":
+        await asyncio.to_thread(lexical_index.ensure_loaded)
+        return await asyncio.to_thread(lexical_index.search, query, k, patient_ids, record_ids)
+
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+        return []
+    # Any term may match (OR), like BM25; the stored, GIN-indexed document is not re-parsed
+    config = literal_column(f"'{SEARCH_TS_CONFIG}'::regconfig")
+    document = literal_column("record_texts.search_vector", TSVECTOR)
+    tsquery = func.to_tsquery(config, " | ".join(terms))
+    rank = func.ts_rank_cd(document, tsquery).label("score")
+    statement = select(RecordText.id, RecordText.record_id, rank).where(document.op("@@")(tsquery))
+    if record_ids is not None:
+        statement = statement.where(RecordText.record_id.in_(list(record_ids)))
+    if patient_ids is not None:
+        statement = statement.join(Record, Record.id == RecordText.record_id).where(
+            Record.patient_id.in_(list(patient_ids))
+        )
+    rows = (await db.execute(statement.order_by(rank.desc()).limit(k))).all()
+    return [(row.id, row.record_id, float(row.score)) for row in rows]
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Iterable[Hashable]], k: int = 60) -> List[Tuple[Hashable, float]]:
+    """Merge best-first rankings by summing 1 / (k + rank); scores need not be comparable"""
+    fused: Dict[Hashable, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] += 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])
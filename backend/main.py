@@ -3,12 +3,16 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from typing import List, Optional
+import asyncio
 import uvicorn
 
 from database import engine, Base, get_db
 from routers import auth, patients, records, admin, manager, ai_search, signup
 from models import User, Patient, Record, AuditLog
 from auth_utils import get_current_user
+from ingestion import ingestion_pool
+from audit import audit_sink
+from otp_reaper import manager_otp_reaper
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
@@ -29,6 +33,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count"],
 )
 
 # Include routers
@@ -40,6 +45,19 @@ app.include_router(admin.router, prefix="/api/admin", tags=["Admin"])
 app.include_router(manager.router, prefix="/api/manager", tags=["Hospital Manager"])
 app.include_router(ai_search.router, prefix="/api/ai", tags=["AI Features"])
 
+@app.on_event("startup")
+async def start_background_workers():
+    ingestion_pool.start()
+    audit_sink.start()
+    manager_otp_reaper.start()
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    await ingestion_pool.stop()
+    await asyncio.to_thread(manager_otp_reaper.stop)
+    # Write out buffered audit entries before exiting
+    await asyncio.to_thread(audit_sink.stop)
+
 @app.get("/")
 async def root():
     return {
@@ -0,0 +1,77 @@
+"""In-process metrics for background workers, caches and pools."""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+
+class LatencyStats:
+    """Count / total / max of observed durations in seconds"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "total_seconds": round(self.total, 6),
+            "avg_ms": round(1000 * self.total / self.count, 3) if self.count else 0.0,
+            "max_ms": round(1000 * self.max, 3)
+        }
+
+
+class MetricsRegistry:
+    """Named counters, latency summaries and gauges for one worker process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._latencies: Dict[str, LatencyStats] = {}
+        self._gauges: Dict[str, Callable[[], object]] = {}
+
+    def incr(self, name: str, amount: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            stats = self._latencies.get(name)
+            if stats is None:
+                stats = self._latencies[name] = LatencyStats()
+            stats.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def register_gauge(self, name: str, read: Callable[[], object]):
+        """Gauges are read lazily when a snapshot is taken"""
+        with self._lock:
+            self._gauges[name] = read
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            latencies = {name: stats.snapshot() for name, stats in self._latencies.items()}
+            gauges = dict(self._gauges)
+        return {
+            "counters": counters,
+            "latencies": latencies,
+            "gauges": {name: read() for name, read in gauges.items()}
+        }
+
+
+# Process-wide registry exposed at /api/admin/metrics
+metrics = MetricsRegistry()
@@ -0,0 +1,69 @@
+"""
+One-shot migration: convert embeddings.embedding_json rows to the packed vector column.
+
+Usage:
+    python migrate_embeddings.py [--batch-size 500]
+
+Safe to re-run; only rows that still have JSON and no vector are touched.
+"""
+import argparse
+import json
+
+from sqlalchemy import inspect, text
+
+from database import engine, SessionLocal
+from embedding_store import EMBEDDING_DIM, USE_PGVECTOR
+from models import Embedding
+
+
+def ensure_schema():
+    """Add the vector column and relax NOT NULL on the legacy JSON column"""
+    columns = {c["name"] for c in inspect(engine).get_columns("embeddings")}
+    with engine.begin() as conn:
+        if "vector" not in columns:
+            if engine.dialect.name == "postgresql":
+                column_type = f"vector({EMBEDDING_DIM})" if USE_PGVECTOR else "bytea"
+            else:
+                column_type = "BLOB"
+            conn.execute(text(f"ALTER TABLE embeddings ADD COLUMN vector {column_type}"))
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("ALTER TABLE embeddings ALTER COLUMN embedding_json DROP NOT NULL"))
+
+
+def migrate(batch_size: int = 500) -> int:
+    """Convert JSON embeddings in batches, returns number of rows converted"""
+    converted = 0
+    db = SessionLocal()
+    try:
+        while True:
+            rows = db.query(Embedding.id, Embedding.embedding_json).filter(
+                Embedding.vector.is_(None),
+                Embedding.embedding_json.isnot(None)
+            ).limit(batch_size).all()
+            if not rows:
+                break
+
+            db.bulk_update_mappings(Embedding, [
+                {
+                    "id": row.id,
+                    "vector": json.loads(row.embedding_json),
+                    "embedding_json": None
+                }
+                for row in rows
+            ])
+            db.commit()
+            converted += len(rows)
+            print(f"Converted {converted} embeddings")
+    finally:
+        db.close()
+    return converted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    ensure_schema()
+    total = migrate(args.batch_size)
+    print(f"Done, {total} embeddings migrated")
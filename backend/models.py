@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, Boolean, ForeignKey, Enum, Text
+from sqlalchemy import Column, String, Integer, DateTime, Boolean, ForeignKey, Enum, Text, Index, DDL, event
 from sqlalchemy.dialects.postgresql import UUID, ARRAY
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -6,6 +6,7 @@ import uuid
 import enum
 
 from database import Base
+from embedding_store import vector_column_type
 
 class RoleEnum(str, enum.Enum):
     PATIENT = "patient"
@@ -17,6 +18,19 @@ class RecordStatusEnum(str, enum.Enum):
     PENDING = "pending"
     PROCESSING = "processing"
     PROCESSED = "processed"
+    FAILED = "failed"  # ingestion gave up after INGESTION_MAX_ATTEMPTS
+
+class IngestionStageEnum(str, enum.Enum):
+    EXTRACT = "extract"
+    CHUNK = "chunk"
+    EMBED = "embed"
+    INDEX = "index"
+
+class JobStatusEnum(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
 
 class FileTypeEnum(str, enum.Enum):
     PDF = "pdf"
@@ -41,6 +55,11 @@ class User(Base):
     patient_profile = relationship("Patient", back_populates="user", uselist=False)
     audit_logs = relationship("AuditLog", back_populates="user")
 
+    # Admin user listing pages newest first
+    __table_args__ = (
+        Index("ix_users_created_at", created_at.desc(), id.desc()),
+    )
+
 class UserRole(Base):
     __tablename__ = "user_roles"
 
@@ -50,6 +69,10 @@ class UserRole(Base):
     
     user = relationship("User", back_populates="roles")
 
+    __table_args__ = (
+        Index("idx_user_roles_user_id", "user_id"),
+    )
+
 class Patient(Base):
     __tablename__ = "patients"
 
@@ -76,6 +99,7 @@ class Record(Base):
     title = Column(String, nullable=False)
     file_type = Column(Enum(FileTypeEnum), nullable=False)
     file_url = Column(String, nullable=False)  # S3 URL
+    checksum_sha256 = Column(String(64))  # hex digest of the uploaded file, computed while streaming
     uploaded_by = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     upload_date = Column(DateTime, default=datetime.utcnow)
     status = Column(Enum(RecordStatusEnum), default=RecordStatusEnum.PENDING)
@@ -85,29 +109,63 @@ class Record(Base):
     embeddings = relationship("Embedding", back_populates="record", cascade="all, delete-orphan")
     shared_access = relationship("SharedAccess", back_populates="record", cascade="all, delete-orphan")
 
+    # Keyset pagination: newest first, per patient and across all patients
+    __table_args__ = (
+        Index("ix_records_patient_upload_date", "patient_id", upload_date.desc(), id.desc()),
+        Index("ix_records_upload_date", upload_date.desc(), id.desc()),
+    )
+
+EXCERPT_LENGTH = 200
+
+def _default_excerpt(context):
+    return context.get_current_parameters()["extracted_text"][:EXCERPT_LENGTH]
+
 class RecordText(Base):
     __tablename__ = "record_texts"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     record_id = Column(UUID(as_uuid=True), ForeignKey("records.id", ondelete="CASCADE"), nullable=False)
     extracted_text = Column(Text, nullable=False)
+    excerpt = Column(String(EXCERPT_LENGTH), nullable=True, default=_default_excerpt)  # Search result preview
     chunk_index = Column(Integer, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     record = relationship("Record", back_populates="texts")
 
+    __table_args__ = (
+        Index("ix_record_texts_record_chunk", "record_id", "chunk_index"),
+        # Lexical index syncs read rows by creation time
+        Index("ix_record_texts_created_at", "created_at"),
+    )
+
+# Keyword search document, parsed once on write rather than on every query.
+# PostgreSQL only (other backends use the in-process index in lexical_index.py),
+# so it is not mapped; init_db.sql adds it to tables created before it existed.
+SEARCH_TS_CONFIG = "english"
+for statement in (
+    "ALTER TABLE record_texts ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    f"GENERATED ALWAYS AS (to_tsvector('{SEARCH_TS_CONFIG}', extracted_text)) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_record_texts_search_vector ON record_texts USING gin (search_vector)",
+):
+    event.listen(RecordText.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
 class Embedding(Base):
     __tablename__ = "embeddings"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     record_id = Column(UUID(as_uuid=True), ForeignKey("records.id", ondelete="CASCADE"), nullable=False)
     chunk_id = Column(UUID(as_uuid=True), ForeignKey("record_texts.id", ondelete="CASCADE"), nullable=True)
-    # For pgvector: vector = Column(Vector(1536))  # Requires pgvector extension
-    embedding_json = Column(Text, nullable=False)  # JSON string of embedding array
+    vector = Column(vector_column_type(), nullable=True)  # float32 bytes, or pgvector when USE_PGVECTOR=true
+    embedding_json = Column(Text, nullable=True)  # Legacy JSON storage, emptied by migrate_embeddings.py
     created_at = Column(DateTime, default=datetime.utcnow)
     
     record = relationship("Record", back_populates="embeddings")
 
+    __table_args__ = (
+        # Vector index syncs read rows by creation time
+        Index("ix_embeddings_created_at", "created_at"),
+    )
+
 class SharedAccess(Base):
     __tablename__ = "shared_access"
 
@@ -119,6 +177,11 @@ class SharedAccess(Base):
     
     record = relationship("Record", back_populates="shared_access")
 
+    # A doctor's live grants are one range scan
+    __table_args__ = (
+        Index("ix_shared_access_doctor_expires", "doctor_id", "expires_at"),
+    )
+
 class AuditLog(Base):
     __tablename__ = "access_logs"
 
@@ -133,6 +196,27 @@ class AuditLog(Base):
     
     user = relationship("User", back_populates="audit_logs")
 
+# Pending login OTPs, one per phone (used by the database OTP store)
+class PhoneOTP(Base):
+    __tablename__ = "phone_otps"
+
+    phone = Column(String, primary_key=True)
+    otp = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+# Cache entries every worker must drop (see invalidation.py)
+class CacheInvalidation(Base):
+    __tablename__ = "cache_invalidations"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    cache = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_cache_invalidations_created_at", "created_at"),
+    )
+
 class ManagerActionOTP(Base):
     __tablename__ = "manager_action_otps"
 
@@ -143,3 +227,29 @@ class ManagerActionOTP(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     verified = Column(Boolean, default=False)
     expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # Equality columns of verify_manager_otp first, the expiry range last
+        Index("ix_manager_action_otps_lookup", "manager_id", "action", "otp", "verified", "expires_at"),
+        # Purge scans
+        Index("ix_manager_action_otps_expires_at", "expires_at"),
+    )
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    record_id = Column(UUID(as_uuid=True), ForeignKey("records.id", ondelete="CASCADE"), nullable=False, index=True)
+    stage = Column(Enum(IngestionStageEnum), nullable=False, default=IngestionStageEnum.EXTRACT)
+    status = Column(Enum(JobStatusEnum), nullable=False, default=JobStatusEnum.QUEUED)
+    attempts = Column(Integer, nullable=False, default=0)  # Attempts at the current stage
+    extracted_text = Column(Text, nullable=True)  # Hand-off from extract to chunk stage
+    last_error = Column(Text, nullable=True)
+    available_at = Column(DateTime, default=datetime.utcnow)  # Retry backoff
+    locked_at = Column(DateTime, nullable=True)  # Lease start while RUNNING
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_ingestion_jobs_status_available", "status", "available_at"),
+    )
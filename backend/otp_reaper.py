@@ -0,0 +1,86 @@
+"""Background purge of used and expired manager action OTPs."""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import delete, func, or_, select
+
+from database import SessionLocal
+from metrics import metrics
+from models import ManagerActionOTP
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+MANAGER_OTP_REAP_SECONDS = float(os.getenv("MANAGER_OTP_REAP_SECONDS", "300"))
+MANAGER_OTP_REAP_BATCH = int(os.getenv("MANAGER_OTP_REAP_BATCH", "1000"))
+
+
+class ManagerOTPReaper:
+    """Deletes verified or expired manager_action_otps rows in small batches"""
+
+    def __init__(self, interval: float = MANAGER_OTP_REAP_SECONDS, batch_size: int = MANAGER_OTP_REAP_BATCH):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_run = {}
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="manager-otp-reaper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.reap()
+            except Exception:
+                logger.exception("Manager OTP purge failed")
+            self._stop.wait(self.interval)
+
+    def reap(self) -> int:
+        """Purge every dead row, one short transaction per batch"""
+        start = time.perf_counter()
+        purged = 0
+        db = SessionLocal()
+        try:
+            dead = or_(ManagerActionOTP.verified.is_(True), ManagerActionOTP.expires_at <= datetime.utcnow())
+            while not self._stop.is_set():
+                ids = db.scalars(select(ManagerActionOTP.id).where(dead).limit(self.batch_size)).all()
+                if not ids:
+                    break
+                db.execute(delete(ManagerActionOTP).where(ManagerActionOTP.id.in_(ids)))
+                db.commit()
+                purged += len(ids)
+                if len(ids) < self.batch_size:
+                    break
+            remaining = db.scalar(select(func.count()).select_from(ManagerActionOTP))
+        finally:
+            db.close()
+
+        elapsed = time.perf_counter() - start
+        metrics.incr("manager_otp.purged", purged)
+        metrics.observe("manager_otp.purge", elapsed)
+        self.last_run = {
+            "rows": remaining,
+            "purged": purged,
+            "rows_per_second": round(purged / elapsed, 1) if elapsed > 0 else 0.0,
+            "at": datetime.utcnow().isoformat()
+        }
+        return purged
+
+
+manager_otp_reaper = ManagerOTPReaper()
+metrics.register_gauge("manager_otp.table", lambda: manager_otp_reaper.last_run)
@@ -0,0 +1,155 @@
+"""
+Short-lived login OTP storage.
+
+OTP_STORE_BACKEND selects the implementation:
+  memory   - per-process dict with heap-based expiry (single worker only)
+  database - phone_otps table, shared by every worker (default in production)
+"""
+import heapq
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import APP_ENV, AsyncSessionLocal
+from metrics import metrics
+from models import PhoneOTP
+
+# Configuration
+OTP_STORE_BACKEND = os.getenv("OTP_STORE_BACKEND", "database" if APP_ENV == "production" else "memory")
+OTP_STORE_MAX_ENTRIES = int(os.getenv("OTP_STORE_MAX_ENTRIES", "100000"))
+OTP_SWEEP_SECONDS = float(os.getenv("OTP_SWEEP_SECONDS", "60"))
+
+
+class OTPStore:
+    """Maps a phone number to its current OTP until it expires"""
+
+    async def set(self, phone: str, otp: str, ttl: float):
+        raise NotImplementedError
+
+    async def get(self, phone: str) -> Optional[str]:
+        """Current OTP, or None when missing or expired"""
+        raise NotImplementedError
+
+    async def consume(self, phone: str, otp: str) -> bool:
+        """Atomically remove the OTP if it matches and is still valid"""
+        raise NotImplementedError
+
+
+class MemoryOTPStore(OTPStore):
+    """
+    Dict lookups plus a min-heap of expiry times.
+
+    Every write first pops expired heap entries, so stale OTPs never pile
+    up; when still full, the entry closest to expiring is evicted.
+    """
+
+    def __init__(self, max_entries: int = OTP_STORE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: Dict[str, Tuple[str, float]] = {}
+        self._expiries: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict_head(self):
+        expires, phone = heapq.heappop(self._expiries)
+        entry = self._entries.get(phone)
+        # Heap entries left behind by overwrites or consumes are skipped
+        if entry is not None and entry[1] == expires:
+            del self._entries[phone]
+            metrics.incr("otp.evicted")
+
+    def sweep(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._expiries and self._expiries[0][0] <= now:
+                self._evict_head()
+
+    async def set(self, phone: str, otp: str, ttl: float):
+        self.sweep()
+        expires = time.monotonic() + ttl
+        with self._lock:
+            while len(self._entries) >= self.max_entries and phone not in self._entries:
+                self._evict_head()
+            self._entries[phone] = (otp, expires)
+            heapq.heappush(self._expiries, (expires, phone))
+            # Compact when overwrites have left the heap mostly stale
+            if len(self._expiries) > 2 * len(self._entries) + 64:
+                self._expiries = [(e, p) for p, (_, e) in self._entries.items()]
+                heapq.heapify(self._expiries)
+
+    async def get(self, phone: str) -> Optional[str]:
+        entry = self._entries.get(phone)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    async def consume(self, phone: str, otp: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(phone)
+            if entry is None or entry[0] != otp or entry[1] <= time.monotonic():
+                return False
+            del self._entries[phone]
+            return True
+
+
+class DatabaseOTPStore(OTPStore):
+    """phone_otps rows keyed by phone; expired rows are purged periodically"""
+
+    def __init__(self, sweep_seconds: float = OTP_SWEEP_SECONDS):
+        self.sweep_seconds = sweep_seconds
+        self._swept_at = 0.0
+
+    # INSERT ... ON CONFLICT (phone) DO UPDATE, so concurrent sends for one phone cannot collide
+    UPSERTS = {"postgresql": postgresql_insert, "sqlite": sqlite_insert}
+
+    async def set(self, phone: str, otp: str, ttl: float):
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            insert = self.UPSERTS[db.get_bind().dialect.name]
+            statement = insert(PhoneOTP).values(phone=phone, otp=otp, expires_at=now + timedelta(seconds=ttl))
+            await db.execute(statement.on_conflict_do_update(
+                index_elements=[PhoneOTP.phone],
+                set_={"otp": statement.excluded.otp, "expires_at": statement.excluded.expires_at}
+            ))
+            if time.monotonic() - self._swept_at > self.sweep_seconds:
+                self._swept_at = time.monotonic()
+                result = await db.execute(delete(PhoneOTP).where(PhoneOTP.expires_at <= now))
+                metrics.incr("otp.evicted", result.rowcount)
+            await db.commit()
+
+    async def get(self, phone: str) -> Optional[str]:
+        async with AsyncSessionLocal() as db:
+            return await db.scalar(select(PhoneOTP.otp).where(
+                PhoneOTP.phone == phone,
+                PhoneOTP.expires_at > datetime.utcnow()
+            ))
+
+    async def consume(self, phone: str, otp: str) -> bool:
+        async with AsyncSessionLocal() as db:
+            # Single DELETE, so concurrent verifications cannot both succeed
+            result = await db.execute(delete(PhoneOTP).where(
+                PhoneOTP.phone == phone,
+                PhoneOTP.otp == otp,
+                PhoneOTP.expires_at > datetime.utcnow()
+            ))
+            await db.commit()
+            return result.rowcount == 1
+
+
+def get_otp_store(backend: str = OTP_STORE_BACKEND) -> OTPStore:
+    if backend == "memory":
+        return MemoryOTPStore()
+    if backend == "database":
+        return DatabaseOTPStore()
+    raise ValueError(f"Unknown OTP_STORE_BACKEND: {backend}")
+
+
+otp_store = get_otp_store()
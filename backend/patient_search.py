@@ -0,0 +1,132 @@
+"""
+Substring search over patient names and medical IDs.
+
+On PostgreSQL the ILIKE predicates are served by pg_trgm GIN indexes (see
+init_db.sql). Other backends use NgramIndex, an in-process trigram inverted
+index rebuilt from the patients table every PATIENT_INDEX_REFRESH_SECONDS.
+Either way, rows where a field starts with the query rank ahead of rows
+that only contain it.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy import case, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Patient
+
+# Configuration
+PATIENT_INDEX_REFRESH_SECONDS = float(os.getenv("PATIENT_INDEX_REFRESH_SECONDS", "60"))
+NGRAM = 3
+
+
+def ngrams(text: str, n: int = NGRAM) -> Set[str]:
+    text = text.lower()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def escape_like(q: str) -> str:
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class NgramIndex:
+    """Trigram -> patient id postings over first_name, last_name and medical_id"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._postings: Dict[str, Set[UUID]] = defaultdict(set)
+        self._fields: Dict[UUID, Tuple[str, str, str]] = {}
+        self._loaded_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def _index(self, postings, fields, patient_id: UUID, first_name: str, last_name: str, medical_id: str):
+        fields[patient_id] = (first_name.lower(), last_name.lower(), medical_id.lower())
+        for value in fields[patient_id]:
+            for gram in ngrams(value):
+                postings[gram].add(patient_id)
+
+    def load(self, db: Session):
+        """Rebuild from the patients table"""
+        postings, fields = defaultdict(set), {}
+        rows = db.execute(select(Patient.id, Patient.first_name, Patient.last_name, Patient.medical_id))
+        for row in rows:
+            self._index(postings, fields, *row)
+        with self._lock:
+            self._postings, self._fields = postings, fields
+            self._loaded_at = time.monotonic()
+
+    def _due(self) -> bool:
+        return time.monotonic() - self._loaded_at > PATIENT_INDEX_REFRESH_SECONDS
+
+    def ensure_loaded(self):
+        """Rebuild if the last load is too old (blocking); one rebuild at a time"""
+        if not self._due():
+            return
+        with self._load_lock:
+            if not self._due():  # rebuilt while this thread waited
+                return
+            db = SessionLocal()
+            try:
+                self.load(db)
+            finally:
+                db.close()
+
+    def add(self, patient: Patient):
+        with self._lock:
+            self._index(self._postings, self._fields, patient.id,
+                        patient.first_name, patient.last_name, patient.medical_id)
+
+    def search(self, q: str) -> List[UUID]:
+        """All matching patient ids, prefix matches first, then by name"""
+        q = q.lower()
+        with self._lock:
+            grams = ngrams(q)
+            if grams:
+                # Candidates must contain every trigram of the query
+                postings = sorted((self._postings.get(g, set()) for g in grams), key=len)
+                candidates = set(postings[0]).intersection(*postings[1:])
+            else:
+                candidates = self._fields.keys()
+            matches = []
+            for patient_id in candidates:
+                fields = self._fields[patient_id]
+                if any(q in value for value in fields):
+                    prefix = any(value.startswith(q) for value in fields)
+                    matches.append((0 if prefix else 1, fields[1], fields[0], str(patient_id), patient_id))
+        matches.sort()
+        return [match[-1] for match in matches]
+
+
+patient_index = NgramIndex()
+
+
+async def search_patients(db: AsyncSession, q: str, offset: int, limit: int) -> List[Patient]:
+    """One page of patients whose name or medical ID contains q"""
+    if db.get_bind().dialect.name == "postgresql":
+        pattern = escape_like(q)
+        fields = (Patient.first_name, Patient.last_name, Patient.medical_id)
+        prefix_rank = case((or_(*(f.ilike(f"{pattern}%") for f in fields)), 0), else_=1)
+        return (await db.scalars(
+            select(Patient)
+            .where(or_(*(f.ilike(f"%{pattern}%") for f in fields)))
+            .order_by(prefix_rank, Patient.last_name, Patient.first_name, Patient.id)
+            .offset(offset)
+            .limit(limit)
+        )).all()
+
+    await asyncio.to_thread(patient_index.ensure_loaded)
+    page = patient_index.search(q)[offset:offset + limit]
+    if not page:
+        return []
+    by_id = {p.id: p for p in (await db.scalars(select(Patient).where(Patient.id.in_(page)))).all()}
+    return [by_id[patient_id] for patient_id in page if patient_id in by_id]
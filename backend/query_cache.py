@@ -0,0 +1,152 @@
+"""
+Cache of search query embeddings.
+
+Two tiers: an in-process LRU/TTL of float32 vectors, and an optional
+SQLite file (QUERY_EMBEDDING_CACHE_PATH) shared by every worker on the
+host and kept across restarts. Concurrent misses for the same query wait
+on a single provider call.
+"""
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+
+from cache import TTLCache
+from embedder import BatchingEmbedder, EMBEDDING_MODEL, EMBEDDING_PROVIDER, embedder
+from embedding_store import decode_vector, encode_vector
+from metrics import metrics
+
+# Configuration
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "10000"))
+QUERY_EMBEDDING_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "86400"))
+QUERY_EMBEDDING_CACHE_PATH = os.getenv("QUERY_EMBEDDING_CACHE_PATH", "")  # empty = memory only
+QUERY_EMBEDDING_DISK_MAX_ROWS = int(os.getenv("QUERY_EMBEDDING_DISK_MAX_ROWS", "200000"))
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+class DiskTier:
+    """query key -> packed vector rows in a local SQLite file"""
+
+    PRUNE_EVERY = 1000  # writes between size/TTL pruning passes
+
+    def __init__(self, path: str, ttl: float, max_rows: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings "
+                "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_query_embeddings_created_at ON query_embeddings(created_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # A connection per call keeps this safe across threads and processes
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT vector FROM query_embeddings WHERE key = ? AND created_at > ?",
+                (key, time.time() - self.ttl)
+            ).fetchone()
+        return decode_vector(row[0]) if row else None
+
+    def set(self, key: str, vector: np.ndarray):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+                (key, encode_vector(vector), time.time())
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM query_embeddings WHERE created_at <= ?", (time.time() - self.ttl,))
+                conn.execute(
+                    "DELETE FROM query_embeddings WHERE key IN ("
+                    "SELECT key FROM query_embeddings ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,)
+                )
+
+
+class QueryEmbeddingCache:
+    """Memory, then disk, then one coalesced provider call per distinct query"""
+
+    def __init__(
+        self,
+        embedder: BatchingEmbedder,
+        maxsize: int = QUERY_EMBEDDING_CACHE_SIZE,
+        ttl: float = QUERY_EMBEDDING_CACHE_TTL,
+        path: str = QUERY_EMBEDDING_CACHE_PATH,
+        disk_max_rows: int = QUERY_EMBEDDING_DISK_MAX_ROWS
+    ):
+        self.embedder = embedder
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.disk = DiskTier(path, ttl, disk_max_rows) if path else None
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # Vectors from another model must never be served
+        self._namespace = f"{EMBEDDING_PROVIDER}:{EMBEDDING_MODEL}:"
+
+    def key(self, query: str) -> str:
+        return hashlib.sha256((self._namespace + normalize_query(query)).encode()).hexdigest()
+
+    async def get(self, query: str) -> np.ndarray:
+        """float32 embedding of query (read-only; copy before modifying)"""
+        key = self.key(query)
+        vector = self.memory.get(key)
+        if vector is not None:
+            metrics.incr("query_embedding.memory_hits")
+            return vector
+
+        task = self._inflight.get(key)
+        if task is not None:
+            metrics.incr("query_embedding.coalesced")
+        else:
+            # Its own task, so a cancelled caller does not cancel the load for the others
+            task = asyncio.ensure_future(self._load(key, query))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task)
+
+    def _finished(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark it retrieved in case every caller was cancelled
+
+    async def _load(self, key: str, query: str) -> np.ndarray:
+        if self.disk is not None:
+            vector = await asyncio.to_thread(self.disk.get, key)
+            if vector is not None:
+                metrics.incr("query_embedding.disk_hits")
+                self.memory.set(key, vector)
+                return vector
+
+        metrics.incr("query_embedding.misses")
+        with metrics.timer("query_embedding.provider"):
+            vector = await self.embedder.embed_one(query)
+        vector = np.ascontiguousarray(vector, dtype=np.float32)
+        vector.flags.writeable = False
+        self.memory.set(key, vector)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, vector)
+        return vector
+
+
+query_embeddings = QueryEmbeddingCache(embedder)
+metrics.register_gauge("query_embedding.memory", query_embeddings.memory.stats)
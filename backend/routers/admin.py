@@ -1,41 +1,98 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Response, Query
+from sqlalchemy import select, func, text, tuple_, Select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+from typing import List, Optional
 from uuid import UUID
-from database import get_db
-from models import User, AuditLog, UserRole
+import os
+from database import get_db, get_async_db
+from models import User, AuditLog, UserRole, RoleEnum
 from schemas import AuditLogResponse
-from auth_utils import get_current_user, require_role
+from auth_utils import get_current_user, require_role, Principal, invalidate_principal
+from metrics import metrics
+from cache import TTLCache
+from pagination import encode_cursor, decode_cursor, NEXT_CURSOR_HEADER, TOTAL_COUNT_HEADER
 
 router = APIRouter()
 
+# Configuration
+USERS_PAGE_SIZE = int(os.getenv("USERS_PAGE_SIZE", "50"))
+USERS_MAX_PAGE_SIZE = int(os.getenv("USERS_MAX_PAGE_SIZE", "200"))
+USER_COUNT_CACHE_TTL = float(os.getenv("USER_COUNT_CACHE_TTL", "60"))
+
+# Keyed by (role, phone_verified, email_verified)
+user_count_cache = TTLCache(maxsize=64, ttl=USER_COUNT_CACHE_TTL)
+
+async def total_users(db: AsyncSession, query: Select, filters: tuple) -> int:
+    """Row count for a filter set: planner estimate or a cached COUNT(*)"""
+    cached = user_count_cache.get(filters)
+    if cached is not None:
+        return cached
+    
+    total = None
+    if not any(f is not None for f in filters) and db.get_bind().dialect.name == "postgresql":
+        # Unfiltered: the planner's estimate is good enough for a dashboard total
+        estimate = await db.scalar(text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'users'"))
+        if estimate is not None and estimate >= 0:
+            total = estimate
+    if total is None:
+        total = await db.scalar(select(func.count()).select_from(query.order_by(None).subquery()))
+    user_count_cache.set(filters, total)
+    return total
+
 @router.get("/users")
 async def list_users(
-    current_user: User = Depends(require_role(["admin"])),
-    db: Session = Depends(get_db)
+    response: Response,
+    role: Optional[RoleEnum] = None,
+    phone_verified: Optional[bool] = None,
+    email_verified: Optional[bool] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(USERS_PAGE_SIZE, ge=1, le=USERS_MAX_PAGE_SIZE),
+    current_user: Principal = Depends(require_role(["admin"])),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """List all users"""
-    users = db.query(User).all()
+    """List users, newest first, one page at a time"""
+    query = select(User)
+    if role is not None:
+        query = query.where(User.roles.any(UserRole.role == role))
+    if phone_verified is not None:
+        query = query.where(User.phone_verified == phone_verified)
+    if email_verified is not None:
+        query = query.where(User.email_verified == email_verified)
     
-    result = []
-    for user in users:
-        roles = db.query(UserRole).filter(UserRole.user_id == user.id).all()
-        result.append({
+    response.headers[TOTAL_COUNT_HEADER] = str(
+        await total_users(db, query, (role, phone_verified, email_verified))
+    )
+    
+    if cursor:
+        query = query.where(tuple_(User.created_at, User.id) < tuple_(*decode_cursor(cursor)))
+    # Roles for the whole page arrive in one extra IN query
+    users = (await db.scalars(
+        query.options(selectinload(User.roles))
+        .order_by(User.created_at.desc(), User.id.desc())
+        .limit(limit + 1)
+    )).all()
+    if len(users) > limit:
+        users = users[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(users[-1].created_at, users[-1].id)
+    
+    return [
+        {
             "id": user.id,
             "phone": user.phone,
             "email": user.email,
             "phone_verified": user.phone_verified,
             "email_verified": user.email_verified,
-            "roles": [r.role.value for r in roles],
+            "roles": [r.role.value for r in user.roles],
             "created_at": user.created_at
-        })
-    
-    return result
+        }
+        for user in users
+    ]
 
 @router.get("/audit-logs", response_model=List[AuditLogResponse])
 async def get_audit_logs(
     limit: int = 100,
-    current_user: User = Depends(require_role(["admin", "hospital_manager"])),
+    current_user: Principal = Depends(require_role(["admin", "hospital_manager"])),
     db: Session = Depends(get_db)
 ):
     """Get audit logs"""
@@ -49,7 +106,7 @@ async def get_audit_logs(
 async def assign_role(
     user_id: UUID,
     role: str,
-    current_user: User = Depends(require_role(["admin"])),
+    current_user: Principal = Depends(require_role(["admin"])),
     db: Session = Depends(get_db)
 ):
     """Assign role to user"""
@@ -74,14 +131,16 @@ async def assign_role(
     
     user_role = UserRole(user_id=user_id, role=role)
     db.add(user_role)
+    invalidate_principal(db, user_id)
     db.commit()
+    user_count_cache.clear()
     
     return {"message": f"Role {role} assigned to user"}
 
 @router.delete("/users/{user_id}")
 async def delete_user(
     user_id: UUID,
-    current_user: User = Depends(require_role(["admin"])),
+    current_user: Principal = Depends(require_role(["admin"])),
     db: Session = Depends(get_db)
 ):
     """Delete user"""
@@ -99,6 +158,15 @@ async def delete_user(
         )
     
     db.delete(user)
+    invalidate_principal(db, user_id)
     db.commit()
+    user_count_cache.clear()
     
     return {"message": "User deleted successfully"}
+
+@router.get("/metrics")
+async def get_metrics(
+    current_user: Principal = Depends(require_role(["admin"]))
+):
+    """Runtime metrics for this worker process"""
+    return metrics.snapshot()
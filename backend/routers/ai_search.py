@@ -1,28 +1,61 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from dataclasses import dataclass
 from uuid import UUID
-import openai
+import asyncio
 import json
+import logging
+import os
+import time
+from openai import AsyncOpenAI
 import numpy as np
-from database import get_db
-from models import User, Record, RecordText, Embedding
+from database import get_async_db
+from models import Record, RecordText, Embedding, Patient, EXCERPT_LENGTH
 from schemas import SearchRequest, SearchResult
-from auth_utils import get_current_user
+from auth_utils import get_current_user, Principal
+from vector_index import vector_index
+from lexical_index import lexical_search, reciprocal_rank_fusion
+from embedder import embedder
+from query_cache import query_embeddings
+from ingestion import store_embeddings
+from sharing import visible_record_ids
+from ask_context import assemble_context, record_text_version
+from answer_cache import answer_cache
+from metrics import metrics
 
 router = APIRouter()
 
+logger = logging.getLogger(__name__)
+
 # OpenAI Configuration
-openai.api_key = os.getenv("OPENAI_API_KEY")
+ASK_MODEL = os.getenv("ASK_MODEL", "gpt-4o-mini")
+
+# Search Configuration
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+HYBRID_LEXICAL_CANDIDATES = int(os.getenv("HYBRID_LEXICAL_CANDIDATES", "200"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+HYBRID_SEMANTIC_RECALL = os.getenv("HYBRID_SEMANTIC_RECALL", "false").lower() == "true"
+SEARCH_LIMIT = 10
+_chat_client = None
+
+def chat_client() -> AsyncOpenAI:
+    """Shared async client, created on first use so the key is only needed for /ask"""
+    global _chat_client
+    if _chat_client is None:
+        _chat_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _chat_client
 
 @router.post("/embed")
 async def create_embeddings(
     record_id: UUID,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Generate embeddings for a record (called after OCR/text extraction)"""
-    record = db.query(Record).filter(Record.id == record_id).first()
+    record = await db.get(Record, record_id)
     if not record:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -30,7 +63,7 @@ async def create_embeddings(
         )
     
     # Get extracted texts
-    texts = db.query(RecordText).filter(RecordText.record_id == record_id).all()
+    texts = (await db.scalars(select(RecordText).where(RecordText.record_id == record_id))).all()
     
     if not texts:
         raise HTTPException(
@@ -38,116 +71,292 @@ async def create_embeddings(
             detail="No text extracted from record"
         )
     
-    # Generate embeddings
-    for text_chunk in texts:
-        response = openai.Embedding.create(
-            model="text-embedding-3-small",
-            input=text_chunk.extracted_text
-        )
-        
-        embedding_vector = response['data'][0]['embedding']
-        
-        # Store embedding
-        embedding = Embedding(
-            record_id=record_id,
-            chunk_id=text_chunk.id,
-            embedding_json=json.dumps(embedding_vector)
-        )
-        db.add(embedding)
+    # Generate embeddings in batched, concurrent provider requests
+    vectors = await embedder.embed([t.extracted_text for t in texts])
     
-    db.commit()
+    # Replace the record's embeddings in one multi-row INSERT
+    chunk_ids = [t.id for t in texts]
+    ids = await db.run_sync(store_embeddings, record_id, chunk_ids, vectors)
+    
+    # Keep the in-memory index in step with the table (and the shared snapshot log)
+    await asyncio.to_thread(vector_index.remove_record, record_id)
+    await asyncio.to_thread(
+        vector_index.add, ids, [record_id] * len(ids), chunk_ids, [record.patient_id] * len(ids), vectors
+    )
+    vector_index.maybe_compact()
     
     return {"message": "Embeddings created successfully", "count": len(texts)}
 
+async def search_scope(current_user: Principal, patient_id: UUID, db: AsyncSession) -> dict:
+    """Partitions of the vector index the user may search (None = unrestricted)"""
+    user_roles = current_user.roles
+    patient_ids = [patient_id] if patient_id else None
+    
+    if "admin" in user_roles or "hospital_manager" in user_roles:
+        return {"patient_ids": patient_ids, "record_ids": None}
+    if "doctor" in user_roles:
+        # Only records shared with this doctor and not yet expired
+        record_ids = await visible_record_ids(db, current_user.id)
+        return {"patient_ids": patient_ids, "record_ids": list(record_ids)}
+    if "patient" in user_roles:
+        own_patient_id = await db.scalar(select(Patient.id).where(Patient.user_id == current_user.id))
+        if not own_patient_id or (patient_id and patient_id != own_patient_id):
+            return {"patient_ids": [], "record_ids": None}
+        return {"patient_ids": [own_patient_id], "record_ids": None}
+    return {"patient_ids": [], "record_ids": None}
+
 @router.post("/search", response_model=List[SearchResult])
 async def semantic_search(
     request: SearchRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Semantic search across medical records"""
-    # Generate query embedding
-    response = openai.Embedding.create(
-        model="text-embedding-3-small",
-        input=request.query
+    """Hybrid keyword + semantic search across medical records"""
+    scope = await search_scope(current_user, request.patient_id, db)
+    
+    # Keyword candidates first: exact terms (drug names, ICD codes) that embeddings blur
+    lexical_hits = []
+    if HYBRID_SEARCH:
+        lexical_hits = await lexical_search(db, request.query, HYBRID_LEXICAL_CANDIDATES, **scope)
+    
+    # Query embedding, cached and shared by concurrent identical searches
+    query_embedding = await query_embeddings.get(request.query)
+    await asyncio.to_thread(vector_index.ensure_loaded)
+    
+    if not lexical_hits:
+        # Nothing matched by keyword: pure semantic search over the user's scope
+        semantic_hits = await asyncio.to_thread(
+            vector_index.search, query_embedding, k=SEARCH_LIMIT, threshold=0.7, **scope
+        )
+        return await hydrate_embedding_hits(db, semantic_hits)
+    
+    # Vector similarity of the keyword candidates only, instead of every row in scope
+    candidate_ids = [chunk_id for chunk_id, _, _ in lexical_hits]
+    scored = await asyncio.to_thread(vector_index.search, query_embedding, k=None, chunk_ids=candidate_ids, **scope)
+    if HYBRID_SEMANTIC_RECALL:
+        # Opt-in: also the best semantic matches that share no keyword (a scan of the whole scope)
+        scored += await asyncio.to_thread(
+            vector_index.search, query_embedding, k=SEARCH_LIMIT, threshold=0.7, **scope
+        )
+    similarity = {}
+    for _, _, chunk_id, score in scored:
+        if chunk_id is not None:  # chunkless (whole-record) embeddings cannot be fused by chunk
+            similarity[chunk_id] = score
+    rankings = [candidate_ids, sorted(similarity, key=lambda chunk_id: -similarity[chunk_id])]
+    fused = reciprocal_rank_fusion(rankings, k=RRF_K)[:SEARCH_LIMIT]
+    # Fused score relative to the best possible (first in every ranking), so 1.0 is a perfect match
+    best = len(rankings) / (RRF_K + 1)
+    return await hydrate_chunk_hits(
+        db, [(chunk_id, similarity.get(chunk_id, 0.0), score / best) for chunk_id, score in fused]
     )
-    query_embedding = np.array(response['data'][0]['embedding'])
+
+async def hydrate_embedding_hits(db: AsyncSession, hits: list) -> List[dict]:
+    """Search results for vector index hits, in hit order"""
+    if not hits:
+        return []
     
-    # Get all embeddings (in production, use pgvector for efficient similarity search)
-    embeddings = db.query(Embedding).all()
+    # Hydrate all hits with one joined query
+    rows = (await db.execute(select(
+        Embedding.id,
+        Record.id.label("record_id"),
+        Record.title,
+        func.coalesce(
+            RecordText.excerpt,
+            func.substr(RecordText.extracted_text, 1, EXCERPT_LENGTH)
+        ).label("excerpt")
+    ).join(
+        Record, Record.id == Embedding.record_id
+    ).outerjoin(
+        RecordText, RecordText.id == Embedding.chunk_id
+    ).where(
+        Embedding.id.in_([embedding_id for embedding_id, _, _, _ in hits])
+    ))).all()
+    by_embedding = {row.id: row for row in rows}
     
     results = []
-    for emb in embeddings:
-        emb_vector = np.array(json.loads(emb.embedding_json))
-        
-        # Calculate cosine similarity
-        similarity = np.dot(query_embedding, emb_vector) / (
-            np.linalg.norm(query_embedding) * np.linalg.norm(emb_vector)
-        )
-        
-        if similarity > 0.7:  # Threshold
-            record = db.query(Record).filter(Record.id == emb.record_id).first()
-            if record and (not request.patient_id or record.patient_id == request.patient_id):
-                chunk = db.query(RecordText).filter(RecordText.id == emb.chunk_id).first()
-                
-                results.append({
-                    "record_id": record.id,
-                    "title": record.title,
-                    "relevance_score": float(similarity),
-                    "excerpt": chunk.extracted_text[:200] if chunk else ""
-                })
-    
-    # Sort by relevance
-    results.sort(key=lambda x: x["relevance_score"], reverse=True)
-    
-    return results[:10]  # Top 10 results
+    for embedding_id, _, _, similarity in hits:
+        row = by_embedding.get(embedding_id)
+        if row:  # record may have been deleted by another worker
+            results.append({
+                "record_id": row.record_id,
+                "title": row.title,
+                "relevance_score": similarity,
+                "excerpt": row.excerpt or ""
+            })
+    
+    return results  # Top 10 results, already sorted by relevance
 
-@router.post("/ask")
-async def ask_report(
-    record_id: UUID,
-    question: str,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Ask questions about a specific report using AI"""
-    record = db.query(Record).filter(Record.id == record_id).first()
+async def hydrate_chunk_hits(db: AsyncSession, hits: List[tuple]) -> List[dict]:
+    """Search results for (chunk_id, similarity, fused score) triples, in fused order"""
+    rows = (await db.execute(select(
+        RecordText.id,
+        Record.id.label("record_id"),
+        Record.title,
+        func.coalesce(
+            RecordText.excerpt,
+            func.substr(RecordText.extracted_text, 1, EXCERPT_LENGTH)
+        ).label("excerpt")
+    ).join(
+        Record, Record.id == RecordText.record_id
+    ).where(
+        RecordText.id.in_([chunk_id for chunk_id, _, _ in hits])
+    ))).all()
+    by_chunk = {row.id: row for row in rows}
+    
+    results = []
+    for chunk_id, similarity, fused_score in hits:
+        row = by_chunk.get(chunk_id)
+        if row:
+            results.append({
+                "record_id": row.record_id,
+                "title": row.title,
+                "relevance_score": similarity,
+                "fused_score": fused_score,
+                "excerpt": row.excerpt or ""
+            })
+    
+    return results
+
+@dataclass
+class AskPlan:
+    """Either a cached answer or the messages to send to the model"""
+    record_title: str
+    text_version: tuple
+    question_embedding: Optional[np.ndarray] = None
+    cached_answer: Optional[str] = None
+    messages: Optional[List[dict]] = None
+
+async def prepare_ask(record_id: UUID, question: str, db: AsyncSession) -> AskPlan:
+    """Load the record, then answer from cache or build the chat messages"""
+    record = await db.get(Record, record_id)
     if not record:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Record not found"
         )
     
-    # Get all text from record
-    texts = db.query(RecordText).filter(RecordText.record_id == record_id).all()
-    full_text = "\n".join([t.extracted_text for t in texts])
+    plan = AskPlan(record_title=record.title, text_version=await record_text_version(db, record_id))
+    
+    # Exact repeats are answered without embedding the question
+    plan.cached_answer = answer_cache.lookup(record_id, plan.text_version, question)
+    if plan.cached_answer is not None:
+        return plan
+    plan.question_embedding = await embedder.embed_one(question)
+    plan.cached_answer = answer_cache.lookup(record_id, plan.text_version, question, plan.question_embedding)
+    if plan.cached_answer is not None:
+        return plan
     
-    if not full_text:
+    # Only the chunks most relevant to the question, within the token budget
+    context = await assemble_context(db, record_id, plan.question_embedding)
+    
+    if not context:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="No text available from this record"
         )
     
+    plan.messages = [
+        {
+            "role": "system",
+            "content": "You are a medical assistant helping patients understand their medical reports. Provide clear, accurate information but remind users to consult their doctor for medical advice."
+        },
+        {
+            "role": "user",
+            "content": f"Based on these excerpts from a medical report:\n\n{context}\n\nQuestion: {question}"
+        }
+    ]
+    return plan
+
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/ask")
+async def ask_report(
+    record_id: UUID,
+    question: str,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Ask questions about a specific report using AI"""
+    start = time.perf_counter()
+    plan = await prepare_ask(record_id, question, db)
+    if plan.cached_answer is not None:
+        return {
+            "question": question,
+            "answer": plan.cached_answer,
+            "record_title": plan.record_title
+        }
+    
     # Generate response using OpenAI
-    response = openai.ChatCompletion.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a medical assistant helping patients understand their medical reports. Provide clear, accurate information but remind users to consult their doctor for medical advice."
-            },
-            {
-                "role": "user",
-                "content": f"Based on this medical report:\n\n{full_text}\n\nQuestion: {question}"
-            }
-        ],
+    response = await chat_client().chat.completions.create(
+        model=ASK_MODEL,
+        messages=plan.messages,
         temperature=0.7,
         max_tokens=500
     )
     
     answer = response.choices[0].message.content
+    # Without streaming the first token arrives with the last one
+    elapsed = time.perf_counter() - start
+    metrics.observe("ask.ttft", elapsed)
+    metrics.observe("ask.completion", elapsed)
+    answer_cache.store(record_id, plan.text_version, question, plan.question_embedding, answer, elapsed)
     
     return {
         "question": question,
         "answer": answer,
-        "record_title": record.title
+        "record_title": plan.record_title
     }
+
+@router.post("/ask/stream")
+async def ask_report_stream(
+    record_id: UUID,
+    question: str,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Ask about a report, streaming the answer as server-sent events"""
+    start = time.perf_counter()
+    plan = await prepare_ask(record_id, question, db)
+    
+    async def events():
+        if plan.cached_answer is not None:
+            yield sse("token", {"text": plan.cached_answer})
+            yield sse("done", {"question": question, "answer": plan.cached_answer, "record_title": plan.record_title})
+            return
+        
+        parts = []
+        try:
+            stream = await chat_client().chat.completions.create(
+                model=ASK_MODEL,
+                messages=plan.messages,
+                temperature=0.7,
+                max_tokens=500,
+                stream=True
+            )
+            async for chunk in stream:
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if not text:
+                    continue
+                if not parts:
+                    metrics.observe("ask.ttft", time.perf_counter() - start)
+                parts.append(text)
+                yield sse("token", {"text": text})
+        except Exception:
+            logger.exception("Streaming answer for record %s failed", record_id)
+            metrics.incr("ask.stream_errors")
+            yield sse("error", {"detail": "Failed to generate answer"})
+            return
+        
+        elapsed = time.perf_counter() - start
+        answer = "".join(parts)
+        metrics.observe("ask.completion", elapsed)
+        if answer:
+            answer_cache.store(record_id, plan.text_version, question, plan.question_embedding, answer, elapsed)
+        yield sse("done", {"question": question, "answer": answer, "record_title": plan.record_title})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,18 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import random
 import os
-from datetime import datetime, timedelta
 
-from database import get_db
+from database import get_async_db
 from models import User, UserRole, RoleEnum
 from schemas import PhoneOTPRequest, OTPVerifyRequest, EmailLoginRequest, TokenResponse, UserResponse
-from auth_utils import get_password_hash, verify_password, create_access_token, get_user_roles
+from auth_utils import get_password_hash, verify_password, create_access_token, get_user_roles, invalidate_principal
+from otp_store import otp_store
 # from twilio.rest import Client  # Uncomment when using Twilio
 router = APIRouter()
 
-# Temporary OTP storage (use Redis in production)
-otp_store = {}
+# Login OTPs expire after 5 minutes
+OTP_TTL_SECONDS = 5 * 60
 
 # Twilio Configuration (uncomment when ready)
 # TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
@@ -24,15 +25,12 @@ def generate_otp() -> str:
     return str(random.randint(100000, 999999))
 
 @router.post("/send-otp")
-async def send_otp(request: PhoneOTPRequest, db: Session = Depends(get_db)):
+async def send_otp(request: PhoneOTPRequest):
     """Send OTP to phone number"""
     otp = generate_otp()
     
-    # Store OTP with expiration (5 minutes)
-    otp_store[request.phone] = {
-        "otp": otp,
-        "expires": datetime.utcnow() + timedelta(minutes=5)
-    }
+    # Store OTP with expiration (replaces any earlier one for this phone)
+    await otp_store.set(request.phone, otp, OTP_TTL_SECONDS)
     
     # TODO: Send via Twilio
     # message = twilio_client.messages.create(
@@ -45,9 +43,9 @@ async def send_otp(request: PhoneOTPRequest, db: Session = Depends(get_db)):
     return {"message": "OTP sent successfully", "otp_dev": otp}
 
 @router.post("/verify-otp", response_model=TokenResponse)
-async def verify_otp(request: OTPVerifyRequest, db: Session = Depends(get_db)):
+async def verify_otp(request: OTPVerifyRequest, db: AsyncSession = Depends(get_async_db)):
     """Verify OTP and create/login user"""
-    stored_otp = otp_store.get(request.phone)
+    stored_otp = await otp_store.get(request.phone)
     
     if not stored_otp:
         raise HTTPException(
@@ -55,44 +53,36 @@ async def verify_otp(request: OTPVerifyRequest, db: Session = Depends(get_db)):
             detail="OTP not found or expired"
         )
     
-    if stored_otp["expires"] < datetime.utcnow():
-        del otp_store[request.phone]
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="OTP expired"
-        )
-    
-    if stored_otp["otp"] != request.otp:
+    # Remove used OTP; fails if it does not match or was used concurrently
+    if not await otp_store.consume(request.phone, request.otp):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid OTP"
         )
     
-    # Remove used OTP
-    del otp_store[request.phone]
-    
     # Find or create user
-    user = db.query(User).filter(User.phone == request.phone).first()
+    user = await db.scalar(select(User).where(User.phone == request.phone))
     
     if not user:
         user = User(phone=request.phone, phone_verified=True)
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
         
         # Assign default role (patient)
         user_role = UserRole(user_id=user.id, role=RoleEnum.PATIENT)
         db.add(user_role)
-        db.commit()
+        await db.commit()
     else:
         user.phone_verified = True
-        db.commit()
+        invalidate_principal(db, user.id)
+        await db.commit()
     
     # Create access token
     access_token = create_access_token(data={"sub": str(user.id)})
     
     # Get user roles
-    roles = get_user_roles(user, db)
+    roles = await get_user_roles(user, db)
     
     return {
         "access_token": access_token,
@@ -108,9 +98,9 @@ async def verify_otp(request: OTPVerifyRequest, db: Session = Depends(get_db)):
     }
 
 @router.post("/login", response_model=TokenResponse)
-async def login(request: EmailLoginRequest, db: Session = Depends(get_db)):
+async def login(request: EmailLoginRequest, db: AsyncSession = Depends(get_async_db)):
     """Email/Password login"""
-    user = db.query(User).filter(User.email == request.email).first()
+    user = await db.scalar(select(User).where(User.email == request.email))
     
     if not user or not verify_password(request.password, user.password_hash):
         raise HTTPException(
@@ -122,7 +112,7 @@ async def login(request: EmailLoginRequest, db: Session = Depends(get_db)):
     access_token = create_access_token(data={"sub": str(user.id)})
     
     # Get user roles
-    roles = get_user_roles(user, db)
+    roles = await get_user_roles(user, db)
     
     return {
         "access_token": access_token,
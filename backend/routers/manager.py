@@ -3,9 +3,9 @@ from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 import random
 from database import get_db
-from models import User, ManagerActionOTP
+from models import ManagerActionOTP
 from schemas import ManagerOTPRequest, ManagerOTPVerify
-from auth_utils import get_current_user, require_role
+from auth_utils import get_current_user, require_role, Principal
 
 router = APIRouter()
 
@@ -15,7 +15,7 @@ def generate_otp() -> str:
 @router.post("/send-otp")
 async def send_manager_otp(
     request: ManagerOTPRequest,
-    current_user: User = Depends(require_role(["hospital_manager"])),
+    current_user: Principal = Depends(require_role(["hospital_manager"])),
     db: Session = Depends(get_db)
 ):
     """Send OTP for sensitive manager action"""
@@ -45,7 +45,7 @@ async def send_manager_otp(
 @router.post("/verify-otp")
 async def verify_manager_otp(
     request: ManagerOTPVerify,
-    current_user: User = Depends(require_role(["hospital_manager"])),
+    current_user: Principal = Depends(require_role(["hospital_manager"])),
     db: Session = Depends(get_db)
 ):
     """Verify OTP before sensitive action"""
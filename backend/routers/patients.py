@@ -1,23 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from uuid import UUID
+from datetime import datetime
+import uuid
 
-from database import get_db
-from models import User, Patient, RoleEnum
+from database import get_async_db
+from models import Patient, RoleEnum
 from schemas import PatientCreate, PatientResponse
-from auth_utils import get_current_user, require_role
+from auth_utils import get_current_user, require_role, Principal
+import patient_search
 router = APIRouter()
 
 @router.post("/", response_model=PatientResponse)
 async def create_patient(
     patient_data: PatientCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create patient profile (for current user)"""
     # Check if patient profile already exists
-    existing = db.query(Patient).filter(Patient.user_id == current_user.id).first()
+    existing = await db.scalar(select(Patient).where(Patient.user_id == current_user.id))
     if existing:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -34,18 +38,21 @@ async def create_patient(
     )
     
     db.add(patient)
-    db.commit()
-    db.refresh(patient)
+    await db.commit()
+    await db.refresh(patient)
+    if db.get_bind().dialect.name != "postgresql":
+        # In-process index fallback; PostgreSQL searches the table directly
+        patient_search.patient_index.add(patient)
     
     return patient
 
 @router.get("/me", response_model=PatientResponse)
 async def get_my_profile(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get current user's patient profile"""
-    patient = db.query(Patient).filter(Patient.user_id == current_user.id).first()
+    patient = await db.scalar(select(Patient).where(Patient.user_id == current_user.id))
     if not patient:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -55,27 +62,23 @@ async def get_my_profile(
 
 @router.get("/search")
 async def search_patients(
-    q: str,
-    current_user: User = Depends(require_role(["doctor", "hospital_manager", "admin"])),
-    db: Session = Depends(get_db)
+    q: str = Query(..., min_length=1),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: Principal = Depends(require_role(["doctor", "hospital_manager", "admin"])),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Search patients by name or medical ID"""
-    patients = db.query(Patient).filter(
-        (Patient.first_name.ilike(f"%{q}%")) |
-        (Patient.last_name.ilike(f"%{q}%")) |
-        (Patient.medical_id.ilike(f"%{q}%"))
-    ).limit(20).all()
-    
-    return patients
+    """Search patients by name or medical ID (prefix matches first)"""
+    return await patient_search.search_patients(db, q, offset, limit)
 
 @router.get("/{patient_id}", response_model=PatientResponse)
 async def get_patient(
     patient_id: UUID,
-    current_user: User = Depends(require_role(["doctor", "hospital_manager", "admin"])),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(require_role(["doctor", "hospital_manager", "admin"])),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get patient by ID"""
-    patient = db.query(Patient).filter(Patient.id == patient_id).first()
+    patient = await db.get(Patient, patient_id)
     if not patient:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -1,59 +1,62 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Request, Response, Query
+from fastapi.responses import StreamingResponse
+from botocore.exceptions import BotoCoreError, ClientError
+from sqlalchemy import select, tuple_, Select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Tuple
 from uuid import UUID
-import boto3
-import os
 from datetime import datetime
-from database import get_db
-from models import User, Record, Patient, AuditLog, FileTypeEnum, RecordStatusEnum
-from schemas import RecordCreate, RecordResponse
-from auth_utils import get_current_user, require_role, get_user_roles
+import asyncio
+import os
+from database import get_async_db, AsyncSessionLocal
+from models import UserRole, Record, Patient, SharedAccess, FileTypeEnum, RecordStatusEnum, RoleEnum
+from schemas import RecordCreate, RecordResponse, ShareRecordRequest, SharedAccessResponse
+from auth_utils import get_current_user, require_role, Principal
+from vector_index import vector_index
+from lexical_index import lexical_index
+from answer_cache import answer_cache
+from storage import upload_stream, delete_file, file_url_for_key
+from ingestion import check_capacity, enqueue_record, ingestion_pool, IngestionBackpressure
+from audit import log_access
+from pagination import encode_cursor, decode_cursor, NEXT_CURSOR_HEADER
+from sharing import visible_record_ids, invalidate_shared_access
+from invalidation import invalidations
 
 router = APIRouter()
 
-# AWS S3 Configuration
-S3_BUCKET = os.getenv("S3_BUCKET_NAME")
-AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
-
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=AWS_ACCESS_KEY,
-    aws_secret_access_key=AWS_SECRET_KEY,
-    region_name=AWS_REGION
-)
-
-def log_access(db: Session, user_id: UUID, action: str, resource: str, resource_id: UUID = None):
-    """Log access for audit trail"""
-    log = AuditLog(
-        user_id=user_id,
-        action=action,
-        resource=resource,
-        resource_id=resource_id,
-        timestamp=datetime.utcnow()
-    )
-    db.add(log)
-    db.commit()
+# Pagination Configuration
+RECORDS_PAGE_SIZE = int(os.getenv("RECORDS_PAGE_SIZE", "50"))
+RECORDS_MAX_PAGE_SIZE = int(os.getenv("RECORDS_MAX_PAGE_SIZE", "200"))
+RECORDS_EXPORT_BATCH = int(os.getenv("RECORDS_EXPORT_BATCH", "500"))
 
 @router.post("/upload", response_model=RecordResponse)
 async def upload_record(
+    request: Request,
     patient_id: UUID,
     title: str,
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Upload medical record to S3"""
     # Verify patient exists
-    patient = db.query(Patient).filter(Patient.id == patient_id).first()
+    patient = await db.get(Patient, patient_id)
     if not patient:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Patient not found"
         )
     
+    # Refuse before uploading when the processing queue is full
+    try:
+        await db.run_sync(check_capacity)
+    except IngestionBackpressure as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "30"}
+        )
+    
     # Determine file type
     file_extension = file.filename.split('.')[-1].lower()
     file_type_map = {
@@ -65,11 +68,17 @@ async def upload_record(
     }
     file_type = file_type_map.get(file_extension, FileTypeEnum.REPORT)
     
-    # Upload to S3
+    # Stream to S3 in parts from the upload thread pool, hashing as we go
     file_key = f"records/{patient_id}/{datetime.utcnow().timestamp()}_{file.filename}"
-    s3_client.upload_fileobj(file.file, S3_BUCKET, file_key)
+    try:
+        uploaded = await upload_stream(file, file_key)
+    except (BotoCoreError, ClientError):
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Could not store the file, please retry"
+        )
     
-    file_url = f"https://{S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{file_key}"
+    file_url = file_url_for_key(file_key)
     
     # Create record
     record = Record(
@@ -77,61 +86,123 @@ async def upload_record(
         title=title,
         file_type=file_type,
         file_url=file_url,
+        checksum_sha256=uploaded.sha256,
         uploaded_by=current_user.id,
         status=RecordStatusEnum.PENDING
     )
     
     db.add(record)
-    db.commit()
-    db.refresh(record)
+    await db.flush()
+    
+    # Extraction, chunking and embedding happen in the background workers; the
+    # job commits with the record, so no record is left pending without one
+    await db.run_sync(enqueue_record, record.id)
+    await db.commit()
+    await db.refresh(record)
+    ingestion_pool.notify()
     
     # Log action
-    log_access(db, current_user.id, "upload_record", "record", record.id)
+    await log_access(current_user.id, "upload_record", "record", record.id, request)
     
     return record
 
-@router.get("/", response_model=List[RecordResponse])
-async def list_records(
-    patient_id: UUID = None,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """List records (filtered by role and patient)"""
-    user_roles = get_user_roles(current_user, db)
+async def visible_records_query(current_user: Principal, patient_id: UUID, db: AsyncSession) -> Optional[Select]:
+    """Records the user may list, or None when there is nothing to see"""
+    user_roles = current_user.roles
     
-    query = db.query(Record)
+    query = select(Record)
     
     if "admin" in user_roles or "hospital_manager" in user_roles:
         # Can see all records
         if patient_id:
-            query = query.filter(Record.patient_id == patient_id)
+            query = query.where(Record.patient_id == patient_id)
     elif "doctor" in user_roles:
-        # Can see shared records
+        # Can see records shared with them and not yet expired
+        record_ids = await visible_record_ids(db, current_user.id)
+        if not record_ids:
+            return None
+        query = query.where(Record.id.in_(record_ids))
         if patient_id:
-            query = query.filter(Record.patient_id == patient_id)
-        # TODO: Filter by shared_access
+            query = query.where(Record.patient_id == patient_id)
     elif "patient" in user_roles:
         # Can only see own records
-        patient = db.query(Patient).filter(Patient.user_id == current_user.id).first()
+        patient = await db.scalar(select(Patient).where(Patient.user_id == current_user.id))
         if not patient:
-            return []
-        query = query.filter(Record.patient_id == patient.id)
+            return None
+        query = query.where(Record.patient_id == patient.id)
+    
+    return query
+
+def keyset_page(query: Select, after: Optional[Tuple[datetime, UUID]], limit: int) -> Select:
+    """Newest first; resumes strictly after the (upload_date, id) of the previous page"""
+    if after:
+        query = query.where(tuple_(Record.upload_date, Record.id) < tuple_(*after))
+    return query.order_by(Record.upload_date.desc(), Record.id.desc()).limit(limit)
+
+@router.get("/", response_model=List[RecordResponse])
+async def list_records(
+    request: Request,
+    response: Response,
+    patient_id: UUID = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(RECORDS_PAGE_SIZE, ge=1, le=RECORDS_MAX_PAGE_SIZE),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """List records (filtered by role and patient), one page at a time"""
+    after = decode_cursor(cursor) if cursor else None
+    query = await visible_records_query(current_user, patient_id, db)
+    if query is None:
+        return []
     
-    records = query.order_by(Record.upload_date.desc()).all()
+    # Fetch one extra row to know whether another page exists
+    records = (await db.scalars(keyset_page(query, after, limit + 1))).all()
+    if len(records) > limit:
+        records = records[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(records[-1].upload_date, records[-1].id)
     
     # Log access
-    log_access(db, current_user.id, "view_records", "records")
+    await log_access(current_user.id, "view_records", "records", request=request)
     
     return records
 
+@router.get("/export")
+async def export_records(
+    request: Request,
+    patient_id: UUID = None,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Stream every visible record as NDJSON, for bulk consumers"""
+    query = await visible_records_query(current_user, patient_id, db)
+    await log_access(current_user.id, "export_records", "records", request=request)
+    
+    async def rows():
+        if query is None:
+            return
+        # Own session: the request-scoped one is closed once the route returns
+        async with AsyncSessionLocal() as stream_db:
+            after = None
+            while True:
+                page = (await stream_db.scalars(keyset_page(query, after, RECORDS_EXPORT_BATCH))).all()
+                for record in page:
+                    yield RecordResponse.model_validate(record).model_dump_json() + "\n"
+                if len(page) < RECORDS_EXPORT_BATCH:
+                    return
+                after = (page[-1].upload_date, page[-1].id)
+                stream_db.expunge_all()
+    
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
+
 @router.get("/{record_id}", response_model=RecordResponse)
 async def get_record(
+    request: Request,
     record_id: UUID,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get single record"""
-    record = db.query(Record).filter(Record.id == record_id).first()
+    record = await db.get(Record, record_id)
     if not record:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -139,18 +210,19 @@ async def get_record(
         )
     
     # Log access
-    log_access(db, current_user.id, "view_record", "record", record.id)
+    await log_access(current_user.id, "view_record", "record", record.id, request)
     
     return record
 
 @router.delete("/{record_id}")
 async def delete_record(
+    request: Request,
     record_id: UUID,
-    current_user: User = Depends(require_role(["hospital_manager", "admin"])),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(require_role(["hospital_manager", "admin"])),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Delete record (requires OTP verification - handled by manager router)"""
-    record = db.query(Record).filter(Record.id == record_id).first()
+    record = await db.get(Record, record_id)
     if not record:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -158,15 +230,108 @@ async def delete_record(
         )
     
     # Delete from S3
-    # Extract key from URL
-    file_key = record.file_url.split(f"{S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/")[1]
-    s3_client.delete_object(Bucket=S3_BUCKET, Key=file_key)
-    
-    # Delete from database
-    db.delete(record)
-    db.commit()
+    await asyncio.to_thread(delete_file, record.file_url)
     
-    # Log action
-    log_access(db, current_user.id, "delete_record", "record", record_id)
+    # Delete from database; other workers drop it from their search indexes
+    await db.delete(record)
+    invalidations.publish(db, "record_index", record_id)
+    # The audit entry commits with the delete, never one without the other
+    await log_access(current_user.id, "delete_record", "record", record_id, request, db=db)
+    await db.commit()
+    await asyncio.to_thread(vector_index.remove_record, record_id)
+    vector_index.maybe_compact()
+    await asyncio.to_thread(lexical_index.remove_record, record_id)
+    answer_cache.invalidate_record(record_id)
     
     return {"message": "Record deleted successfully"}
+
+async def get_shareable_record(record_id: UUID, current_user: Principal, db: AsyncSession) -> Record:
+    """Record whose sharing the user may change: their own, or any for staff"""
+    record = await db.get(Record, record_id)
+    if not record:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Record not found"
+        )
+    
+    user_roles = current_user.roles
+    if "admin" in user_roles or "hospital_manager" in user_roles:
+        return record
+    if "patient" in user_roles:
+        own_patient_id = await db.scalar(select(Patient.id).where(Patient.user_id == current_user.id))
+        if own_patient_id == record.patient_id:
+            return record
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="Insufficient permissions"
+    )
+
+@router.post("/{record_id}/share", response_model=SharedAccessResponse)
+async def share_record(
+    request: Request,
+    record_id: UUID,
+    share: ShareRecordRequest,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Grant a doctor access to a record (re-sharing updates the expiry)"""
+    record = await get_shareable_record(record_id, current_user, db)
+    
+    is_doctor = await db.scalar(select(UserRole.id).where(
+        UserRole.user_id == share.doctor_id,
+        UserRole.role == RoleEnum.DOCTOR
+    ))
+    if not is_doctor:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User is not a doctor"
+        )
+    
+    access = await db.scalar(select(SharedAccess).where(
+        SharedAccess.record_id == record.id,
+        SharedAccess.doctor_id == share.doctor_id
+    ))
+    if access:
+        access.granted_at = datetime.utcnow()
+        access.expires_at = share.expires_at
+    else:
+        access = SharedAccess(
+            record_id=record.id,
+            doctor_id=share.doctor_id,
+            granted_at=datetime.utcnow(),
+            expires_at=share.expires_at
+        )
+        db.add(access)
+    invalidate_shared_access(db, share.doctor_id)
+    await log_access(current_user.id, "share_record", "record", record.id, request, db=db)
+    await db.commit()
+    
+    return access
+
+@router.delete("/{record_id}/share/{doctor_id}")
+async def revoke_record_share(
+    request: Request,
+    record_id: UUID,
+    doctor_id: UUID,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Revoke a doctor's access to a record"""
+    record = await get_shareable_record(record_id, current_user, db)
+    
+    access = await db.scalar(select(SharedAccess).where(
+        SharedAccess.record_id == record.id,
+        SharedAccess.doctor_id == doctor_id
+    ))
+    if not access:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Record is not shared with this doctor"
+        )
+    
+    await db.delete(access)
+    invalidate_shared_access(db, doctor_id)
+    await log_access(current_user.id, "revoke_record_share", "record", record.id, request, db=db)
+    await db.commit()
+    
+    return {"message": "Access revoked successfully"}
@@ -63,6 +63,7 @@ class RecordResponse(BaseModel):
     title: str
     file_type: str
     file_url: str
+    checksum_sha256: Optional[str] = None
     uploaded_by: UUID
     upload_date: datetime
     status: str
@@ -70,6 +71,20 @@ class RecordResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class ShareRecordRequest(BaseModel):
+    doctor_id: UUID
+    expires_at: Optional[datetime] = None
+
+class SharedAccessResponse(BaseModel):
+    id: UUID
+    record_id: UUID
+    doctor_id: UUID
+    granted_at: datetime
+    expires_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
 # Manager OTP Schemas
 class ManagerOTPRequest(BaseModel):
     action: str
@@ -86,7 +101,8 @@ class SearchRequest(BaseModel):
 class SearchResult(BaseModel):
     record_id: UUID
     title: str
-    relevance_score: float
+    relevance_score: float  # cosine similarity to the query (0 for a keyword match without an embedding)
+    fused_score: Optional[float] = None  # hybrid ranking, 1.0 = first by keyword and by similarity
     excerpt: str
 
 # Audit Log Schemas
@@ -0,0 +1,48 @@
+"""Record sharing with doctors and the cached per-doctor access set."""
+import os
+from datetime import datetime
+from typing import FrozenSet
+from uuid import UUID
+
+from sqlalchemy import select, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import TTLCache
+from invalidation import invalidations
+from metrics import metrics
+from models import SharedAccess
+
+# Configuration
+SHARED_ACCESS_CACHE_TTL = float(os.getenv("SHARED_ACCESS_CACHE_TTL", "60"))
+SHARED_ACCESS_CACHE_SIZE = int(os.getenv("SHARED_ACCESS_CACHE_SIZE", "10000"))
+
+# Keyed by doctor id; entries never outlive the earliest grant expiry they contain
+shared_access_cache = TTLCache(maxsize=SHARED_ACCESS_CACHE_SIZE, ttl=SHARED_ACCESS_CACHE_TTL)
+metrics.register_gauge("sharing.access_cache", shared_access_cache.stats)
+invalidations.subscribe("shared_access", lambda key: shared_access_cache.pop(UUID(key)))
+
+def invalidate_shared_access(db, doctor_id: UUID):
+    """Call before committing a grant or revocation; reaches every worker"""
+    invalidations.publish(db, "shared_access", doctor_id)
+
+async def visible_record_ids(db: AsyncSession, doctor_id: UUID) -> FrozenSet[UUID]:
+    """Ids of records currently shared with a doctor (one index range scan on a miss)"""
+    await invalidations.poll(db)
+    cached = shared_access_cache.get(doctor_id)
+    if cached is not None:
+        return cached
+
+    now = datetime.utcnow()
+    rows = (await db.execute(select(SharedAccess.record_id, SharedAccess.expires_at).where(
+        SharedAccess.doctor_id == doctor_id,
+        or_(SharedAccess.expires_at.is_(None), SharedAccess.expires_at > now)
+    ))).all()
+    record_ids = frozenset(row.record_id for row in rows)
+
+    # Drop the entry as soon as its first grant expires
+    expiries = [row.expires_at for row in rows if row.expires_at is not None]
+    ttl = SHARED_ACCESS_CACHE_TTL
+    if expiries:
+        ttl = min(ttl, (min(expiries) - now).total_seconds())
+    shared_access_cache.set(doctor_id, record_ids, ttl=ttl)
+    return record_ids
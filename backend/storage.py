@@ -0,0 +1,149 @@
+"""S3 storage for uploaded record files."""
+import asyncio
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import boto3
+from fastapi import UploadFile
+
+from metrics import metrics
+
+# AWS S3 Configuration
+S3_BUCKET = os.getenv("S3_BUCKET_NAME")
+AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
+AWS_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None  # S3-compatible stand-in, e.g. http://localhost:9000
+
+# Upload Configuration (S3 requires parts of at least 5MB, except the last)
+S3_UPLOAD_PART_SIZE = max(int(os.getenv("S3_UPLOAD_PART_SIZE", str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", "4"))  # parts in flight per upload
+S3_UPLOAD_THREADS = int(os.getenv("S3_UPLOAD_THREADS", "16"))  # shared by all uploads in a worker
+
+s3_client = boto3.client(
+    's3',
+    aws_access_key_id=AWS_ACCESS_KEY,
+    aws_secret_access_key=AWS_SECRET_KEY,
+    region_name=AWS_REGION,
+    endpoint_url=S3_ENDPOINT_URL
+)
+
+upload_executor = ThreadPoolExecutor(max_workers=S3_UPLOAD_THREADS, thread_name_prefix="s3-upload")
+
+def file_url_for_key(file_key: str) -> str:
+    if S3_ENDPOINT_URL:
+        return f"{S3_ENDPOINT_URL.rstrip('/')}/{S3_BUCKET}/{file_key}"
+    return f"https://{S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{file_key}"
+
+def file_key_from_url(file_url: str) -> str:
+    if S3_ENDPOINT_URL and file_url.startswith(S3_ENDPOINT_URL.rstrip('/') + "/"):
+        return file_url.split(f"/{S3_BUCKET}/", 1)[1]
+    return file_url.split(f"{S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/")[1]
+
+def download_file(file_url: str) -> bytes:
+    """Fetch a stored record file (blocking, run it off the event loop)"""
+    response = s3_client.get_object(Bucket=S3_BUCKET, Key=file_key_from_url(file_url))
+    return response["Body"].read()
+
+def delete_file(file_url: str):
+    """Remove a stored record file (blocking, run it off the event loop)"""
+    s3_client.delete_object(Bucket=S3_BUCKET, Key=file_key_from_url(file_url))
+
+@dataclass
+class UploadResult:
+    size: int
+    sha256: str
+    parts: int
+
+async def upload_stream(
+    upload: UploadFile,
+    file_key: str,
+    part_size: int = S3_UPLOAD_PART_SIZE,
+    concurrency: int = S3_UPLOAD_CONCURRENCY,
+    client=None
+) -> UploadResult:
+    """
+    Stream an uploaded file to S3 part by part without blocking the event loop.
+
+    At most `concurrency` parts (but at least the two read up front) are held
+    in memory, each from being read until its upload finishes; the SHA-256
+    of the whole file is computed as parts are read. Files that fit in one
+    part use a single PUT. A failed multipart upload is aborted.
+    """
+    client = client or s3_client
+    loop = asyncio.get_running_loop()
+
+    def run(fn, *args, **kwargs):
+        return loop.run_in_executor(upload_executor, lambda: fn(*args, **kwargs))
+
+    digest = hashlib.sha256()
+
+    async def read_part() -> bytes:
+        part = await upload.read(part_size)
+        if part:
+            await run(digest.update, part)  # hashlib releases the GIL on large buffers
+        return part
+
+    first = await read_part()
+    second = await read_part() if len(first) == part_size else b""
+
+    with metrics.timer("storage.upload"):
+        if not second:
+            await run(client.put_object, Bucket=S3_BUCKET, Key=file_key, Body=first)
+            metrics.incr("storage.uploaded_bytes", len(first))
+            return UploadResult(size=len(first), sha256=digest.hexdigest(), parts=1)
+
+        upload_id = (await run(client.create_multipart_upload, Bucket=S3_BUCKET, Key=file_key))["UploadId"]
+        slots = asyncio.Semaphore(concurrency)
+        pending, etags, size = set(), {}, 0
+
+        def upload_part(number: int, holder: list):
+            # Taken out of the holder in the worker thread, so the part is freed
+            # before the loop hears it is done and reads the next one
+            return client.upload_part(
+                Bucket=S3_BUCKET, Key=file_key, UploadId=upload_id, PartNumber=number, Body=holder.pop()
+            )
+
+        async def send(number: int, holder: list):
+            try:
+                response = await run(upload_part, number, holder)
+                etags[number] = response["ETag"]
+            finally:
+                slots.release()
+
+        try:
+            # Already read to choose PUT vs multipart; dropped from here so each is freed once sent
+            queued, first, second = [first, second], None, None
+            number = 0
+            while True:
+                await slots.acquire()  # wait for a free slot before reading more of the body
+                part = queued.pop(0) if queued else await read_part()
+                if not part:
+                    slots.release()
+                    break
+                number += 1
+                size += len(part)
+                pending.add(asyncio.create_task(send(number, [part])))
+                part = None
+                # Surface a failed part now rather than after reading the rest of the file
+                done = {task for task in pending if task.done()}
+                for task in done:
+                    task.result()
+                pending -= done
+            await asyncio.gather(*pending)
+            await run(
+                client.complete_multipart_upload,
+                Bucket=S3_BUCKET, Key=file_key, UploadId=upload_id,
+                MultipartUpload={"Parts": [{"PartNumber": n, "ETag": etags[n]} for n in sorted(etags)]}
+            )
+        except BaseException:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            await run(client.abort_multipart_upload, Bucket=S3_BUCKET, Key=file_key, UploadId=upload_id)
+            raise
+
+    metrics.incr("storage.uploaded_bytes", size)
+    return UploadResult(size=size, sha256=digest.hexdigest(), parts=len(etags))
@@ -0,0 +1,696 @@
+"""In-memory vector index used by semantic search over record chunks."""
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from typing import Iterable, List, Optional, Tuple
+from uuid import UUID
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from embedding_store import EMBEDDING_DIM, row_vector
+from index_snapshot import ADD, Snapshot, SnapshotStore, encode_ids
+from invalidation import invalidations
+from metrics import metrics
+from models import Embedding, Record
+
+logger = logging.getLogger(__name__)
+
+# Rows written by other workers are pulled in at most this often
+SYNC_INTERVAL_SECONDS = float(os.getenv("VECTOR_INDEX_SYNC_SECONDS", "30"))
+# Each sync re-reads this far behind the watermark, for rows stamped before it
+# that committed after the last sync (long transactions, clock skew between hosts)
+SYNC_OVERLAP_SECONDS = float(os.getenv("VECTOR_INDEX_SYNC_OVERLAP_SECONDS", "300"))
+# none = float32 matrix in memory; int8 / binary = quantized first pass,
+# exact float re-rank of the best candidates from a memory-mapped scratch file
+VECTOR_INDEX_QUANTIZATION = os.getenv("VECTOR_INDEX_QUANTIZATION", "none")
+VECTOR_INDEX_RERANK_CANDIDATES = int(os.getenv("VECTOR_INDEX_RERANK_CANDIDATES", "100"))
+VECTOR_INDEX_SCRATCH_DIR = os.getenv("VECTOR_INDEX_SCRATCH_DIR") or None  # default: system temp dir
+# Shared on-disk snapshot that workers mmap (empty = every worker loads the table itself)
+VECTOR_INDEX_SNAPSHOT_DIR = os.getenv("VECTOR_INDEX_SNAPSHOT_DIR", "")
+VECTOR_INDEX_COMPACT_ROWS = int(os.getenv("VECTOR_INDEX_COMPACT_ROWS", "5000"))
+QUANTIZATIONS = ("none", "int8", "binary")
+SCORE_BLOCK_ROWS = 4096  # quantized rows widened to float per step
+PURGE_MIN_DEAD_ROWS = 1024  # without a snapshot, removed rows are dropped from memory in bulk
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Return float32 copy of vectors scaled to unit length (zero rows stay zero)"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(vectors / norms, dtype=np.float32)
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 codes and scales: vectors ~= codes * scales[:, None]"""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def quantize_binary(vectors: np.ndarray) -> np.ndarray:
+    """Sign bits, 8 dimensions per byte"""
+    return np.packbits(vectors > 0, axis=1)
+
+
+def _grow(array: np.ndarray, size: int, needed: int) -> np.ndarray:
+    # Grow geometrically so repeated appends stay amortized O(1) per row
+    if needed <= array.shape[0]:
+        return array
+    capacity = max(needed, 2 * array.shape[0], 64)
+    grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:size] = array[:size]
+    return grown
+
+
+def _gather(
+    base: Optional[np.ndarray],
+    tail: np.ndarray,
+    rows: np.ndarray,
+    base_size: int,
+    tail_index: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Rows of base (row < base_size) or tail (the rest) in the order given"""
+    def from_tail(tail_rows):
+        tail_rows = tail_rows - base_size
+        return tail[tail_index[tail_rows] if tail_index is not None else tail_rows]
+
+    if base_size == 0:
+        return from_tail(rows)
+    in_base = rows < base_size
+    if in_base.all():
+        return base[rows]
+    if not in_base.any():
+        return from_tail(rows)
+    out = np.empty((rows.size,) + tail.shape[1:], dtype=tail.dtype)
+    out[in_base] = base[rows[in_base]]
+    out[~in_base] = from_tail(rows[~in_base])
+    return out
+
+
+class ScratchVectors:
+    """
+    Append-only float32 rows in an unlinked temp file, read through mmap.
+    Only the rows a search re-ranks are paged in; the page cache can drop
+    them again under memory pressure, unlike anonymous heap memory.
+    """
+
+    def __init__(self, dim: int, directory: Optional[str] = VECTOR_INDEX_SCRATCH_DIR):
+        self.dim = dim
+        self.rows = 0
+        self._file = tempfile.TemporaryFile(prefix="vector-index-", dir=directory)
+        self._view = np.empty((0, dim), dtype=np.float32)
+
+    def append(self, vectors: np.ndarray) -> np.ndarray:
+        """Write rows at the end of the file, returns their row numbers"""
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        self._file.flush()
+        start, self.rows = self.rows, self.rows + vectors.shape[0]
+        # A fresh read-only map; searches holding the previous one are unaffected
+        self._view = np.memmap(self._file, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+        return np.arange(start, self.rows, dtype=np.int64)
+
+    def view(self) -> np.ndarray:
+        return self._view
+
+    def close(self):
+        self._file.close()
+
+
+class VectorIndex:
+    """
+    All chunk embeddings held as pre-normalized float32 rows.
+
+    Row i belongs to ids[i] / record_ids[i] / chunk_ids[i] / patient_ids[i].
+    Cosine similarity against every row is a matrix-vector product; rows are
+    also partitioned by patient and record so scoped searches only touch
+    the rows they are allowed to see.
+
+    With a snapshot directory, the first rows (the base) are a read-only
+    mapping of the current on-disk generation shared with the other workers.
+    Rows added since live in process memory (the tail) and are written to
+    the generation's delta log.
+
+    Removing a record only tombstones its rows: they are masked out of
+    searches and partitions are updated in place, so row numbers never
+    shift. The next compaction (a new generation, or an in-memory purge
+    without a snapshot directory) drops them.
+    """
+
+    def __init__(
+        self,
+        dim: int = EMBEDDING_DIM,
+        quantization: str = VECTOR_INDEX_QUANTIZATION,
+        rerank_candidates: int = VECTOR_INDEX_RERANK_CANDIDATES,
+        snapshot_dir: str = VECTOR_INDEX_SNAPSHOT_DIR
+    ):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown VECTOR_INDEX_QUANTIZATION: {quantization}")
+        self.dim = dim
+        self.quantization = quantization
+        self.rerank_candidates = rerank_candidates
+        self._store = SnapshotStore(snapshot_dir, dim) if snapshot_dir else None
+        self._scratch = None
+        self._compaction = None
+        self._lock = threading.RLock()
+        self._load_lock = threading.RLock()
+        self._stale = set()  # records changed by other workers, reloaded on the next ensure_loaded
+        self._reset()
+
+    def _reset(self, snapshot: Optional[Snapshot] = None):
+        self._base = snapshot
+        self._base_size = snapshot.rows if snapshot is not None else 0
+        self._live = np.ones(self._base_size, dtype=bool)
+        self._dead = 0
+        self._generation = snapshot.generation if snapshot is not None else None
+        self._log_offset = 0
+
+        self._matrix = np.empty((0, self.dim), dtype=np.float32)
+        if self.quantization != "none":
+            # Exact vectors live in the scratch file, rows in memory only hold codes
+            if self._scratch is not None:
+                self._scratch.close()
+            self._scratch = ScratchVectors(self.dim)
+            self._scratch_rows = np.empty(0, dtype=np.int64)
+            if self.quantization == "int8":
+                self._codes = np.empty((0, self.dim), dtype=np.int8)
+                self._scales = np.empty(0, dtype=np.float32)
+            else:
+                self._codes = np.empty((0, (self.dim + 7) // 8), dtype=np.uint8)
+
+        self._size = self._base_size
+        if snapshot is not None:
+            self._ids = snapshot.ids
+            self._record_ids = snapshot.record_ids
+            self._chunk_ids = snapshot.chunk_ids
+            self._patient_ids = snapshot.patient_ids
+            self._watermark = snapshot.watermark
+        else:
+            self._ids = np.empty(0, dtype=object)
+            self._record_ids = np.empty(0, dtype=object)
+            self._chunk_ids = np.empty(0, dtype=object)
+            self._patient_ids = np.empty(0, dtype=object)
+            self._watermark = None
+        self._known_ids = set(self._ids)
+        self._rebuild_partitions()
+        self._synced_at = 0.0
+        self._loaded = snapshot is not None
+
+    def __len__(self) -> int:
+        return self._size - self._dead
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @staticmethod
+    def _row_query(db: Session):
+        return db.query(
+            Embedding.id,
+            Embedding.record_id,
+            Embedding.chunk_id,
+            Record.patient_id,
+            Embedding.vector,
+            Embedding.embedding_json,
+            Embedding.created_at
+        ).join(Record, Record.id == Embedding.record_id)
+
+    def load(self, db: Session):
+        """Rebuild the index from the embeddings table"""
+        rows = self._row_query(db).all()
+        with self._lock:
+            self._reset()
+            self._add_rows(rows)
+            self._synced_at = time.monotonic()
+            self._loaded = True
+
+    def ensure_loaded(self):
+        """
+        Load on first use, then pull rows added by other workers periodically.
+        Blocking: async callers should run it in a thread.
+        """
+        if self._loaded and not self._stale and time.monotonic() - self._synced_at < SYNC_INTERVAL_SECONDS:
+            return
+        with self._load_lock:
+            due = time.monotonic() - self._synced_at >= SYNC_INTERVAL_SECONDS
+            if self._loaded and not self._stale and not due:
+                return  # another request refreshed it while we waited
+            if self._store is not None:
+                self._refresh_from_snapshot()
+            db = SessionLocal()
+            try:
+                if not self._loaded:
+                    self._stale.clear()
+                    self.load(db)
+                    if self._store is not None:
+                        # Publish the first generation so other workers map it instead
+                        self.compact()
+                else:
+                    if due:
+                        self.sync(db)
+                    while self._stale:
+                        self.reload_record(db, self._stale.pop())
+            finally:
+                db.close()
+
+    def mark_stale(self, record_id: UUID):
+        """
+        A record's embeddings were replaced or deleted, possibly by another
+        worker. sync() only sees new rows, so the record is reloaded instead.
+        With a snapshot directory, removals already arrive through the log.
+        """
+        if self._loaded and self._store is None:
+            self._stale.add(record_id)
+
+    def sync(self, db: Session):
+        """Append embeddings created since the last load/sync, minus the overlap window"""
+        query = self._row_query(db)
+        if self._watermark is not None:
+            since = self._watermark - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+            query = query.filter(Embedding.created_at >= since)
+        rows = query.all()
+        with self._lock:
+            # Rows of the overlap window that are already loaded are skipped by id
+            self._add_rows(rows)
+            self._synced_at = time.monotonic()
+
+    def reload_record(self, db: Session, record_id: UUID):
+        """Replace a record's rows with what is currently stored for it"""
+        if not self._loaded:
+            return  # the first load picks everything up
+        rows = self._row_query(db).filter(Embedding.record_id == record_id).all()
+        self.remove_record(record_id)
+        if rows:
+            self.add(
+                [row.id for row in rows],
+                [row.record_id for row in rows],
+                [row.chunk_id for row in rows],
+                [row.patient_id for row in rows],
+                np.stack([row_vector(row.vector, row.embedding_json) for row in rows])
+            )
+
+    def _add_rows(self, rows):
+        if not rows:
+            return
+        fresh = [row for row in rows if row.id not in self._known_ids]
+        if fresh:
+            self._append(
+                [row.id for row in fresh],
+                [row.record_id for row in fresh],
+                [row.chunk_id for row in fresh],
+                [row.patient_id for row in fresh],
+                normalize_rows(np.stack([row_vector(row.vector, row.embedding_json) for row in fresh]))
+            )
+        stamps = [row.created_at for row in rows if row.created_at is not None]
+        if stamps and (self._watermark is None or max(stamps) > self._watermark):
+            self._watermark = max(stamps)
+
+    def add(
+        self,
+        ids: List[UUID],
+        record_ids: List[UUID],
+        chunk_ids: List[Optional[UUID]],
+        patient_ids: List[UUID],
+        vectors
+    ):
+        """Append embeddings to the index, skipping ids it already holds"""
+        vectors = normalize_rows(vectors)
+        if vectors.shape[0] and vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+        self._append(ids, record_ids, chunk_ids, patient_ids, vectors)
+        if self._store is not None and len(ids):
+            # Blocks while another process compacts: call from a thread
+            self._store.append(self._store.encode_add(ids, record_ids, chunk_ids, patient_ids, vectors))
+
+    def _append(self, ids, record_ids, chunk_ids, patient_ids, vectors: np.ndarray):
+        with self._lock:
+            fresh = [i for i, emb_id in enumerate(ids) if emb_id not in self._known_ids]
+            if not fresh:
+                return
+            if len(fresh) < len(ids):
+                ids = [ids[i] for i in fresh]
+                record_ids = [record_ids[i] for i in fresh]
+                chunk_ids = [chunk_ids[i] for i in fresh]
+                patient_ids = [patient_ids[i] for i in fresh]
+                vectors = vectors[fresh]
+            count = len(fresh)
+
+            tail_size = self._size - self._base_size
+            needed = tail_size + count
+            if self.quantization == "none":
+                self._matrix = _grow(self._matrix, tail_size, needed)
+                self._matrix[tail_size:needed] = vectors
+            else:
+                self._codes = _grow(self._codes, tail_size, needed)
+                self._scratch_rows = _grow(self._scratch_rows, tail_size, needed)
+                if self.quantization == "int8":
+                    self._scales = _grow(self._scales, tail_size, needed)
+                    self._codes[tail_size:needed], self._scales[tail_size:needed] = quantize_int8(vectors)
+                else:
+                    self._codes[tail_size:needed] = quantize_binary(vectors)
+                self._scratch_rows[tail_size:needed] = self._scratch.append(vectors)
+
+            self._ids = np.concatenate([self._ids, np.array(ids, dtype=object)])
+            self._record_ids = np.concatenate([self._record_ids, np.array(record_ids, dtype=object)])
+            self._chunk_ids = np.concatenate([self._chunk_ids, np.array(chunk_ids, dtype=object)])
+            self._patient_ids = np.concatenate([self._patient_ids, np.array(patient_ids, dtype=object)])
+            self._live = _grow(self._live, self._size, self._size + count)
+            self._live[self._size:self._size + count] = True
+            for row, (record_id, patient_id, chunk_id) in enumerate(
+                zip(record_ids, patient_ids, chunk_ids), start=self._size
+            ):
+                self._rows_by_record[record_id].append(row)
+                self._rows_by_patient[patient_id].append(row)
+                if chunk_id is not None:
+                    self._row_by_chunk[chunk_id] = row
+            self._known_ids.update(ids)
+            self._size += count
+
+    def remove_record(self, record_id: UUID) -> int:
+        """Drop every embedding belonging to a record, returns rows removed"""
+        removed = self._remove(record_id)
+        if self._store is not None:
+            # Other workers may hold rows this one has not synced yet
+            self._store.append(self._store.encode_remove(record_id))
+        return removed
+
+    def _remove(self, record_id: UUID) -> int:
+        with self._lock:
+            rows = self._rows_by_record.pop(record_id, None)
+            if not rows:
+                return 0
+            # Tombstones: no array is copied and no partition rebuilt. Patient
+            # partitions keep the dead rows, scoped searches mask them out.
+            self._live[rows] = False
+            self._dead += len(rows)
+            for row in rows:
+                chunk_id = self._chunk_ids[row]
+                if chunk_id is not None and self._row_by_chunk.get(chunk_id) == row:
+                    del self._row_by_chunk[chunk_id]
+                self._known_ids.discard(self._ids[row])
+            if self._store is None and self._dead >= max(PURGE_MIN_DEAD_ROWS, self._size // 4):
+                self._purge()
+            return len(rows)
+
+    def _purge(self):
+        """Drop tombstoned rows from memory (no snapshot, so every row is in the tail)"""
+        size = self._size
+        keep = self._live[:size]
+        if self.quantization == "none":
+            self._matrix = np.ascontiguousarray(self._matrix[:size][keep])
+        else:
+            # Dead rows stay in the scratch file until the next full load
+            self._codes = np.ascontiguousarray(self._codes[:size][keep])
+            self._scratch_rows = self._scratch_rows[:size][keep]
+            if self.quantization == "int8":
+                self._scales = self._scales[:size][keep]
+        self._ids = self._ids[keep]
+        self._record_ids = self._record_ids[keep]
+        self._chunk_ids = self._chunk_ids[keep]
+        self._patient_ids = self._patient_ids[keep]
+        self._size = self._ids.shape[0]
+        self._live = np.ones(self._size, dtype=bool)
+        self._dead = 0
+        self._rebuild_partitions()
+        metrics.incr("vector_index.purges")
+
+    def _rebuild_partitions(self):
+        # Searches read partitions under the lock; new dicts keep the swap atomic
+        rows_by_record, rows_by_patient, row_by_chunk = defaultdict(list), defaultdict(list), {}
+        for row, (record_id, patient_id, chunk_id) in enumerate(
+            zip(self._record_ids, self._patient_ids, self._chunk_ids)
+        ):
+            if not self._live[row]:
+                continue
+            rows_by_record[record_id].append(row)
+            rows_by_patient[patient_id].append(row)
+            if chunk_id is not None:
+                row_by_chunk[chunk_id] = row
+        self._rows_by_record, self._rows_by_patient = rows_by_record, rows_by_patient
+        self._row_by_chunk = row_by_chunk
+
+    def _refresh_from_snapshot(self):
+        """Switch to the current on-disk generation, then replay its delta log"""
+        generation = self._store.current_generation()
+        if generation is None:
+            return
+        if generation == self._generation:
+            entries, offset = self._store.read_log(generation, self._log_offset)
+            with self._lock:
+                self._replay(entries)
+                self._log_offset = offset
+            return
+
+        try:
+            snapshot = self._store.open(generation)
+        except FileNotFoundError:
+            return  # replaced while opening; the next refresh picks up the newer one
+        if snapshot.dim != self.dim or snapshot.quantization != self.quantization:
+            logger.warning(
+                "Ignoring vector index snapshot %s: built for %s/%s, this worker uses %s/%s",
+                generation, snapshot.dim, snapshot.quantization, self.dim, self.quantization
+            )
+            return
+        entries, offset = self._store.read_log(generation, 0)
+        with self._lock:
+            self._reset(snapshot)
+            self._replay(entries)
+            self._log_offset = offset
+        metrics.incr("vector_index.snapshot_loads")
+
+    def _replay(self, entries):
+        # Entries this worker wrote itself are replayed too; in log order that is harmless
+        adds = []
+
+        def flush():
+            if adds:
+                columns = list(zip(*(ids for ids, _ in adds)))
+                self._append(*columns, normalize_rows(np.stack([vector for _, vector in adds])))
+                adds.clear()
+
+        for entry in entries:
+            if entry[0] == ADD:
+                adds.append((entry[1], entry[2]))
+            else:
+                flush()
+                self._remove(entry[1])
+        flush()
+
+    def _needs_compaction(self) -> bool:
+        if self._store is None or not self._loaded:
+            return False
+        if self._base is None:
+            return True
+        return (self._size - self._base_size) + self._dead >= VECTOR_INDEX_COMPACT_ROWS
+
+    def maybe_compact(self):
+        """Compact in the background once enough rows changed since the snapshot"""
+        if not self._needs_compaction() or (self._compaction is not None and self._compaction.is_alive()):
+            return
+        self._compaction = threading.Thread(target=self._compact_quietly, name="vector-index-compaction", daemon=True)
+        self._compaction.start()
+
+    def _compact_quietly(self):
+        try:
+            self.compact()
+        except Exception:
+            logger.exception("Vector index compaction failed")
+
+    def compact(self) -> bool:
+        """Write live rows as the next snapshot generation and switch to it"""
+        if self._store is None:
+            return False
+        with self._load_lock, self._store.exclusive():
+            # Catch up with every logged change first; appends wait for the lock
+            self._refresh_from_snapshot()
+            if not self._needs_compaction():
+                return False
+
+            start = time.perf_counter()
+            with self._lock:
+                size, base_size = self._size, self._base_size
+                base, live = self._base, self._live[:self._size].copy()
+                tail = self._matrix[:size - base_size] if self.quantization == "none" else self._scratch.view()
+                tail_index = self._scratch_rows[:size - base_size] if self.quantization != "none" else None
+                columns = (self._ids, self._record_ids, self._chunk_ids, self._patient_ids)
+                watermark = self._watermark
+            rows = np.flatnonzero(live)
+
+            generation = (self._generation or 0) + 1
+            writer = self._store.create(generation, rows.size, self.quantization, watermark)
+            for offset in range(0, rows.size, SCORE_BLOCK_ROWS):
+                block = rows[offset:offset + SCORE_BLOCK_ROWS]
+                end = offset + block.size
+                vectors = _gather(base.vectors if base else None, tail, block, base_size, tail_index)
+                writer.vectors[offset:end] = vectors
+                writer.ids[offset:end] = encode_ids(*(column[block] for column in columns))
+                if self.quantization == "int8":
+                    writer.codes[offset:end], writer.scales[offset:end] = quantize_int8(vectors)
+                elif self.quantization == "binary":
+                    writer.codes[offset:end] = quantize_binary(vectors)
+            self._store.publish(generation, writer)
+            self._refresh_from_snapshot()
+
+        metrics.observe("vector_index.compaction", time.perf_counter() - start)
+        logger.info("Vector index snapshot generation %s written (%s rows)", generation, rows.size)
+        return True
+
+    def _scoped_rows(
+        self,
+        patient_ids: Optional[Iterable[UUID]],
+        record_ids: Optional[Iterable[UUID]],
+        chunk_ids: Optional[Iterable[UUID]] = None
+    ) -> Optional[np.ndarray]:
+        """Row positions visible under the given filters, None when unfiltered"""
+        if patient_ids is None and record_ids is None and chunk_ids is None:
+            return None
+        if chunk_ids is not None:
+            rows = [self._row_by_chunk[c] for c in set(chunk_ids) if c in self._row_by_chunk]
+            if record_ids is not None:
+                allowed = set(record_ids)
+                rows = [row for row in rows if self._record_ids[row] in allowed]
+            if patient_ids is not None:
+                allowed = set(patient_ids)
+                rows = [row for row in rows if self._patient_ids[row] in allowed]
+        elif record_ids is not None:
+            rows = [row for record_id in set(record_ids) for row in self._rows_by_record.get(record_id, ())]
+            if patient_ids is not None:
+                allowed = set(patient_ids)
+                rows = [row for row in rows if self._patient_ids[row] in allowed]
+        else:
+            rows = [row for patient_id in set(patient_ids) for row in self._rows_by_patient.get(patient_id, ())]
+        rows = np.array(sorted(rows), dtype=np.intp)
+        return rows[self._live[rows]] if self._dead else rows
+
+    def search(
+        self,
+        query_vector,
+        k: Optional[int] = 10,
+        threshold: Optional[float] = None,
+        patient_ids: Optional[Iterable[UUID]] = None,
+        record_ids: Optional[Iterable[UUID]] = None,
+        chunk_ids: Optional[Iterable[UUID]] = None
+    ) -> List[Tuple[UUID, UUID, Optional[UUID], float]]:
+        """
+        Return (embedding_id, record_id, chunk_id, score) for the k best rows,
+        best first. k=None returns every row above threshold.
+
+        patient_ids / record_ids / chunk_ids restrict scoring to those rows
+        only; None means no restriction, an empty collection matches nothing.
+        """
+        with self._lock:
+            size, base_size = self._size, self._base_size
+            base, all_live = self._base, self._dead == 0
+            live = self._live[:size].copy() if not all_live else None
+            ids, record_ids_arr, chunk_ids_arr = self._ids, self._record_ids, self._chunk_ids
+            rows = self._scoped_rows(patient_ids, record_ids, chunk_ids)
+            if self.quantization == "none":
+                tail, tail_index = self._matrix[:size - base_size], None
+            else:
+                codes = self._codes[:size - base_size]
+                scales = self._scales[:size - base_size] if self.quantization == "int8" else None
+                tail, tail_index = self._scratch.view(), self._scratch_rows[:size - base_size]
+        if size == 0 or (rows is not None and rows.size == 0):
+            return []
+
+        query = normalize_rows(query_vector)[0]
+        base_vectors = base.vectors if base is not None else None
+        scores = None
+        if rows is None:
+            rows = np.arange(size)
+            if self.quantization == "none":
+                # Unscoped: one product per segment, no row gather
+                scores = tail @ query if base is None else np.concatenate([base_vectors @ query, tail @ query])
+            if not all_live:
+                rows = rows[live]
+                scores = scores[live] if scores is not None else None
+
+        if self.quantization != "none":
+            candidates = max(k, self.rerank_candidates) if k is not None else None
+            if candidates is not None and rows.size > candidates:
+                # Cheap approximate pass, then exact scores for the best candidates only
+                approx = self._approximate_scores(base, codes, scales, base_size, rows, query)
+                rows = rows[np.argpartition(-approx, candidates - 1)[:candidates]]
+        if scores is None:
+            scores = _gather(base_vectors, tail, rows, base_size, tail_index) @ query
+
+        count = scores.shape[0]
+        if k is not None and k < count:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(count)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        if threshold is not None:
+            top = top[scores[top] > threshold]
+
+        return [
+            (ids[rows[i]], record_ids_arr[rows[i]], chunk_ids_arr[rows[i]], float(scores[i]))
+            for i in top
+        ]
+
+    def _approximate_scores(
+        self,
+        base: Optional[Snapshot],
+        codes: np.ndarray,
+        scales: Optional[np.ndarray],
+        base_size: int,
+        rows: np.ndarray,
+        query: np.ndarray
+    ) -> np.ndarray:
+        """First-pass scores for rows from their quantized codes, in blocks to bound temporaries"""
+        scores = np.empty(rows.size, dtype=np.float32)
+        if self.quantization == "binary":
+            query_bits = quantize_binary(query.reshape(1, -1))[0]
+        for start in range(0, rows.size, SCORE_BLOCK_ROWS):
+            block = rows[start:start + SCORE_BLOCK_ROWS]
+            block_codes = _gather(base.codes if base else None, codes, block, base_size)
+            if self.quantization == "int8":
+                block_scales = _gather(base.scales if base else None, scales, block, base_size)
+                scores[start:start + block.size] = (block_codes.astype(np.float32) @ query) * block_scales
+            else:
+                # Fewer differing sign bits = closer; negate so larger is better
+                distance = np.bitwise_count(np.bitwise_xor(block_codes, query_bits)).sum(axis=1, dtype=np.int32)
+                scores[start:start + block.size] = -distance
+        return scores
+
+    def memory_bytes(self) -> int:
+        """Private resident bytes of the scoring arrays (mapped snapshot and scratch pages not counted)"""
+        with self._lock:
+            if self.quantization == "none":
+                return int(self._matrix.nbytes)
+            total = self._codes.nbytes + self._scratch_rows.nbytes
+            if self.quantization == "int8":
+                total += self._scales.nbytes
+            return int(total)
+
+    def stats(self) -> dict:
+        base = self._base
+        return {
+            "rows": len(self),
+            "quantization": self.quantization,
+            "resident_bytes": self.memory_bytes(),
+            "scratch_rows": self._scratch.rows if self._scratch is not None else 0,
+            "snapshot_generation": self._generation,
+            "snapshot_rows": self._base_size,
+            "snapshot_bytes": int(
+                base.vectors.nbytes + (base.codes.nbytes if base.codes is not None else 0)
+            ) if base is not None else 0,
+            "delta_rows": self._size - self._base_size,
+            "masked_rows": self._dead
+        }
+
+
+# Process-wide index shared by the AI routes
+vector_index = VectorIndex()
+metrics.register_gauge("vector_index", vector_index.stats)
+invalidations.subscribe("record_index", lambda key: vector_index.mark_stale(UUID(key)))
@@ -34,19 +34,29 @@ const AIChatPanel = ({ recordId, recordTitle }: AIChatPanelProps) => {
       let response;
       
       if (recordId) {
-        // Ask specific report
-        const { data, error } = await api.post<{ answer: string }>(
-          `/ai/ask/${recordId}`,
-          { question: userMessage }
+        // Ask specific report, rendering the answer as tokens arrive
+        let streamError: string | undefined;
+        const appendToAnswer = (text: string) =>
+          setMessages(prev => {
+            const last = prev[prev.length - 1];
+            return last.role === "assistant"
+              ? [...prev.slice(0, -1), { role: "assistant", content: last.content + text }]
+              : [...prev, { role: "assistant", content: text }];
+          });
+
+        const { error } = await api.stream(
+          `/ai/ask/stream?record_id=${recordId}&question=${encodeURIComponent(userMessage)}`,
+          (event, data) => {
+            if (event === "token") appendToAnswer(data.text);
+            else if (event === "error") streamError = data.detail;
+          }
         );
-        
-        if (error) {
-          toast.error(error);
-          setMessages(prev => prev.slice(0, -1));
-          return;
+
+        if (error || streamError) {
+          toast.error(error || streamError);
+          setMessages(prev => prev.slice(0, prev[prev.length - 1].role === "assistant" ? -2 : -1));
         }
-        
-        response = data?.answer || "No response received";
+        return;
       } else {
         // Semantic search across all reports
         const { data, error } = await api.post<any>("/ai/search", { 
@@ -133,7 +143,7 @@ const AIChatPanel = ({ recordId, recordTitle }: AIChatPanelProps) => {
                   )}
                 </div>
               ))}
-              {isLoading && (
+              {isLoading && messages[messages.length - 1]?.role === "user" && (
                 <div className="flex gap-3">
                   <div className="h-8 w-8 rounded-full bg-primary flex items-center justify-center">
                     <Bot className="h-4 w-4 text-primary-foreground animate-pulse" />
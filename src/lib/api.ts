@@ -81,6 +81,48 @@ class ApiClient {
     return this.request<T>(endpoint, { method: "DELETE" });
   }
 
+  // POST and read a text/event-stream response, calling onEvent per event
+  async stream(
+    endpoint: string,
+    onEvent: (event: string, data: any) => void
+  ): Promise<ApiResponse<void>> {
+    try {
+      const response = await fetch(`${this.baseUrl}${endpoint}`, {
+        method: "POST",
+        headers: this.getHeaders(),
+      });
+
+      if (!response.ok || !response.body) {
+        const error = await response.json().catch(() => ({ detail: "Request failed" }));
+        return { error: error.detail || "Request failed" };
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+          const raw = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          let event = "message";
+          let data = "";
+          for (const line of raw.split("\n")) {
+            if (line.startsWith("event: ")) event = line.slice(7);
+            else if (line.startsWith("data: ")) data += line.slice(6);
+          }
+          onEvent(event, data ? JSON.parse(data) : null);
+        }
+      }
+      return {};
+    } catch (error) {
+      return { error: error instanceof Error ? error.message : "Network error" };
+    }
+  }
+
   async uploadFile<T>(endpoint: string, file: File): Promise<ApiResponse<T>> {
     const formData = new FormData();
     formData.append("file", file);